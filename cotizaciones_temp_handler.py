@@ -16,6 +16,7 @@ import os
 import re
 import sys
 import json
+import multiprocessing
 import time
 import shutil
 from glob import glob
@@ -200,5 +201,6 @@ def main(dry_run=False):
     return 0
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     dry = "--dry-run" in sys.argv or "-n" in sys.argv
     sys.exit(main(dry_run=dry))
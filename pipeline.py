@@ -15,12 +15,15 @@ Uso:
     python pipeline.py
 """
 
+import errno
+import io
+import multiprocessing
 import os
 import re
-import json
 import shutil
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from glob import glob
 
@@ -34,7 +37,7 @@ if _SCRIPTS_PATH not in sys.path:
 
 # Importar funciones de los scripts en script-popular-master/
 from convertir_a_searchable import convertir_pdf_a_searchable
-from verificar_prestamos_v3 import procesar_paquete, validar_consistencia, generar_reporte, merge_pdfs
+from verificar_prestamos_v3 import procesar_paquete, validar_consistencia, generar_reporte, merge_pdfs, json_a_bytes, generar_txt_desde_reporte, salida_con_prefijo
 
 
 # =============================================================================
@@ -65,11 +68,21 @@ MAX_ERRORES = 2
 # Tiempo máximo para archivos .tmp huérfanos (en segundos)
 MAX_EDAD_TMP = 3600  # 1 hora
 
+# Grupos procesados en paralelo (cada uno en su propio proceso).
+# Cada grupo ya reparte el OCR de sus páginas entre varios Tesseract,
+# así que se mantiene bajo para no saturar la CPU ni la memoria (ver
+# MEMORIA_MAX_LOTE_MB en script-popular-master/convertir_a_searchable.py).
+GRUPOS_EN_PARALELO = 2
+
 
 # =============================================================================
 # FUNCIONES DE UTILIDAD
 # =============================================================================
 
+# Tramos de caracteres no seguros y/o guiones bajos: se colapsan a un solo _
+_RE_TRAMO_NO_SEGURO = re.compile(r'(?:[^\w\-]|_)+')
+
+
 def sanitizar_nombre(nombre_pdf):
     """
     Convierte nombre de PDF a nombre seguro para archivos.
@@ -77,19 +90,21 @@ def sanitizar_nombre(nombre_pdf):
     """
     # Quitar extensión
     nombre = os.path.splitext(nombre_pdf)[0]
-    # Reemplazar caracteres problemáticos por _
-    nombre = re.sub(r'[^\w\-]', '_', nombre)
-    # Eliminar guiones bajos múltiples
-    nombre = re.sub(r'_+', '_', nombre)
+    # Reemplazar caracteres problemáticos por _ (sin dejar guiones bajos múltiples)
+    nombre = _RE_TRAMO_NO_SEGURO.sub('_', nombre)
     # Quitar _ al inicio y final
     nombre = nombre.strip('_')
     return nombre
 
 
+_RE_SUFIJO_PAGINA = re.compile(r'-(\d+)-\d+\.pdf$', re.IGNORECASE)
+_RE_DIV_NUMERO = re.compile(r'DIV\s*\((\d+)\)')
+
+
 def extraer_numero_pagina(ruta_pdf):
     """Extrae número de página del nombre: archivo-X-Y.pdf → X"""
     nombre = os.path.basename(ruta_pdf)
-    match = re.search(r'-(\d+)-\d+\.pdf$', nombre, re.IGNORECASE)
+    match = _RE_SUFIJO_PAGINA.search(nombre)
     return int(match.group(1)) if match else 0
 
 
@@ -109,7 +124,7 @@ def extraer_orden_documento(ruta_pdf):
         return (3, nombre)  # Continuaciones
     elif 'DIV' in nombre:
         # Ordenar DIV, DIV(1), DIV(2) correctamente
-        match = re.search(r'DIV\s*\((\d+)\)', nombre)
+        match = _RE_DIV_NUMERO.search(nombre)
         if match:
             return (4 + int(match.group(1)), nombre)  # DIV(1)=5, DIV(2)=6
         return (4, nombre)  # DIV sin número = 4
@@ -132,9 +147,9 @@ def agrupar_pdfs_por_base(lista_pdfs):
     for pdf in lista_pdfs:
         nombre = os.path.basename(pdf)
         # Verificar si tiene patrón -X-Y.pdf
-        if re.search(r'-\d+-\d+\.pdf$', nombre, re.IGNORECASE):
+        if _RE_SUFIJO_PAGINA.search(nombre):
             # Quitar sufijo -X-Y.pdf
-            base = re.sub(r'-\d+-\d+\.pdf$', '', nombre, flags=re.IGNORECASE)
+            base = _RE_SUFIJO_PAGINA.sub('', nombre)
             clave = sanitizar_nombre(base)
             grupos.setdefault(clave, []).append(pdf)
         else:
@@ -160,12 +175,36 @@ def agrupar_pdfs_por_base(lista_pdfs):
     return grupos
 
 
+def _nombres_en_carpeta(carpeta):
+    """
+    Nombres (normalizados con normcase) de las entradas de una carpeta,
+    obtenidos en un solo listado. Vacío si la carpeta no existe.
+    """
+    try:
+        with os.scandir(carpeta or ".") as entradas:
+            return {os.path.normcase(e.name) for e in entradas}
+    except FileNotFoundError:
+        return set()
+
+
+def _carpetas_faltantes():
+    """Carpetas de CARPETAS que no existen (un listado por carpeta padre)."""
+    existentes = {}
+    faltantes = []
+    for carpeta in CARPETAS.values():
+        padre, base = os.path.split(os.path.normpath(carpeta))
+        if padre not in existentes:
+            existentes[padre] = _nombres_en_carpeta(padre)
+        if os.path.normcase(base) not in existentes[padre]:
+            faltantes.append(carpeta)
+    return faltantes
+
+
 def crear_carpetas():
     """Crea todas las carpetas necesarias si no existen."""
-    for nombre, carpeta in CARPETAS.items():
-        if not os.path.exists(carpeta):
-            os.makedirs(carpeta)
-            print(f"  Carpeta creada: {carpeta}/")
+    for carpeta in _carpetas_faltantes():
+        os.makedirs(carpeta, exist_ok=True)
+        print(f"  Carpeta creada: {carpeta}/")
 
 
 def inicializar_log():
@@ -179,44 +218,64 @@ def inicializar_log():
 # FUNCIONES DE LOG
 # =============================================================================
 
+# Índice en memoria del log: errores por archivo y último intento por
+# (archivo, etapa). Se carga del CSV en la primera consulta de cada proceso
+# y escribir_log lo mantiene al día, así no se relee el log por cada PDF.
+_errores_por_archivo = {}
+_ultimo_intento = {}
+_indice_log_cargado = False
+
+
+def _indexar_linea_log(linea):
+    """Agrega una línea del log al índice en memoria."""
+    partes = linea.strip().split(";")
+    if len(partes) >= 3 and partes[2] == "ERROR":
+        _errores_por_archivo[partes[0]] = _errores_por_archivo.get(partes[0], 0) + 1
+    if len(partes) >= 6:
+        try:
+            intento = int(partes[5])
+        except ValueError:
+            return
+        clave = (partes[0], partes[1])
+        if intento > _ultimo_intento.get(clave, 0):
+            _ultimo_intento[clave] = intento
+
+
+def _cargar_indice_log():
+    """Lee el log CSV una sola vez por proceso y construye el índice."""
+    global _indice_log_cargado
+    if _indice_log_cargado:
+        return
+    _indice_log_cargado = True
+    if os.path.exists(LOG_FILE):
+        with open(LOG_FILE, "r", encoding="utf-8") as f:
+            for linea in f:
+                _indexar_linea_log(linea)
+
+
 def escribir_log(archivo, etapa, resultado, mensaje="-", intento_num=1):
     """Escribe una entrada en el log CSV."""
+    _cargar_indice_log()
     timestamp = datetime.now().isoformat()
+    registro = f"{archivo};{etapa};{resultado};{timestamp};{mensaje};{intento_num}\n"
     with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{archivo};{etapa};{resultado};{timestamp};{mensaje};{intento_num}\n")
+        f.write(registro)
+    # Indexar el registro tal como se leería del archivo (el mensaje puede
+    # traer saltos de línea)
+    for linea in io.StringIO(registro, newline=None):
+        _indexar_linea_log(linea)
 
 
 def contar_errores(archivo):
     """Cuenta cuántos errores tiene un archivo en el log."""
-    if not os.path.exists(LOG_FILE):
-        return 0
-    
-    errores = 0
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        for linea in f:
-            partes = linea.strip().split(";")
-            if len(partes) >= 3 and partes[0] == archivo and partes[2] == "ERROR":
-                errores += 1
-    return errores
+    _cargar_indice_log()
+    return _errores_por_archivo.get(archivo, 0)
 
 
 def obtener_ultimo_intento(archivo, etapa):
     """Obtiene el número del último intento para una etapa específica."""
-    if not os.path.exists(LOG_FILE):
-        return 0
-    
-    ultimo_intento = 0
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        for linea in f:
-            partes = linea.strip().split(";")
-            if len(partes) >= 6 and partes[0] == archivo and partes[1] == etapa:
-                try:
-                    intento = int(partes[5])
-                    if intento > ultimo_intento:
-                        ultimo_intento = intento
-                except:
-                    pass
-    return ultimo_intento
+    _cargar_indice_log()
+    return _ultimo_intento.get((archivo, etapa), 0)
 
 
 # =============================================================================
@@ -226,18 +285,23 @@ def obtener_ultimo_intento(archivo, etapa):
 def limpiar_tmp_huerfanos():
     """Borra archivos .tmp con más de 1 hora de antigüedad."""
     carpeta = CARPETAS["resultados"]
-    if not os.path.exists(carpeta):
-        return
     
     ahora = time.time()
-    for tmp in glob(os.path.join(carpeta, "*.tmp")):
-        try:
-            edad = ahora - os.path.getmtime(tmp)
-            if edad > MAX_EDAD_TMP:
-                os.remove(tmp)
-                print(f"  Limpiado .tmp huérfano: {os.path.basename(tmp)}")
-        except Exception as e:
-            print(f"  Error limpiando {tmp}: {e}")
+    try:
+        # scandir trae la fecha de modificación junto con el listado
+        with os.scandir(carpeta) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith(".tmp"):
+                    continue
+                try:
+                    edad = ahora - entrada.stat().st_mtime
+                    if edad > MAX_EDAD_TMP:
+                        os.remove(entrada.path)
+                        print(f"  Limpiado .tmp huérfano: {entrada.name}")
+                except Exception as e:
+                    print(f"  Error limpiando {entrada.path}: {e}")
+    except FileNotFoundError:
+        return
 
 
 # =============================================================================
@@ -258,41 +322,6 @@ def hacer_ocr(nombre_pdf, ruta_entrada, ruta_salida):
         raise Exception(f"Error en OCR: {str(e)}")
 
 
-def generar_txt_desde_reporte(reporte, ruta_txt):
-    """
-    Genera un archivo TXT legible a partir del reporte.
-    """
-    with open(ruta_txt, "w", encoding="utf-8") as f:
-        f.write("REPORTE DE VERIFICACIÓN DE PRÉSTAMOS\n")
-        f.write(f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("=" * 60 + "\n\n")
-        
-        f.write(f"Archivo: {reporte['archivo']}\n")
-        f.write(f"Estado: {reporte['resumen_validacion']}\n")
-        f.write(f"Páginas: {reporte['total_paginas']}\n\n")
-        
-        f.write("DOCUMENTOS DETECTADOS:\n")
-        for tipo, info in reporte['documentos_detectados'].items():
-            f.write(f"  {tipo} (Páginas {info['paginas']}):\n")
-            for campo, valor in info['datos'].items():
-                if isinstance(valor, dict):
-                    f.write(f"    {campo}: {valor}\n")
-                else:
-                    f.write(f"    {campo}: {valor}\n")
-            f.write("\n")
-        
-        f.write("VALIDACIONES:\n")
-        for val, estado in reporte['validaciones'].items():
-            f.write(f"  {val}: {estado}\n")
-        
-        if reporte['alertas']:
-            f.write("\nALERTAS:\n")
-            for alerta in reporte['alertas']:
-                f.write(f"  ! {alerta}\n")
-        
-        f.write("\n" + "=" * 60 + "\n")
-
-
 def generar_json(nombre_pdf, ruta_pdf_ocr, ruta_json_final, ruta_txt_final):
     """
     Genera el JSON y TXT a partir del PDF con OCR.
@@ -315,15 +344,17 @@ def generar_json(nombre_pdf, ruta_pdf_ocr, ruta_json_final, ruta_txt_final):
         reporte = generar_reporte(ruta_pdf_ocr, documentos, num_paginas, validaciones, alertas)
         
         # Escribir JSON a archivo temporal
-        with open(ruta_tmp_json, "w", encoding="utf-8") as f:
-            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        with open(ruta_tmp_json, "wb") as f:
+            f.write(json_a_bytes(reporte))
         
         # Escribir TXT a archivo temporal
         generar_txt_desde_reporte(reporte, ruta_tmp_txt)
         
-        # Renombrar a archivos finales (atómico)
-        os.rename(ruta_tmp_json, ruta_json_final)
-        os.rename(ruta_tmp_txt, ruta_txt_final)
+        # Renombrar a archivos finales, seguidos y sin trabajo entre ambos.
+        # El JSON va último: su existencia marca el grupo como procesado,
+        # así que nunca aparece sin su TXT.
+        os.replace(ruta_tmp_txt, ruta_txt_final)
+        os.replace(ruta_tmp_json, ruta_json_final)
         
         return True
         
@@ -339,14 +370,20 @@ def generar_json(nombre_pdf, ruta_pdf_ocr, ruta_json_final, ruta_txt_final):
 
 
 def mover_archivo(origen, destino):
-    """Mueve un archivo de una carpeta a otra."""
-    if os.path.exists(origen):
-        # Si ya existe en destino, eliminarlo primero
+    """Mueve un archivo de una carpeta a otra (reemplaza el destino si existe)."""
+    if not os.path.exists(origen):
+        return False
+    try:
+        # Un solo rename, que además reemplaza el destino existente
+        os.replace(origen, destino)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Otra unidad: copiar y borrar, eliminando antes el destino
         if os.path.exists(destino):
             os.remove(destino)
         shutil.move(origen, destino)
-        return True
-    return False
+    return True
 
 
 # =============================================================================
@@ -547,6 +584,12 @@ def procesar_pdf(nombre_pdf):
         return "ERROR"
 
 
+def _procesar_grupo_en_paralelo(nombre_grupo, lista_pdfs):
+    """procesar_grupo para el pool: cada línea lleva el nombre del grupo."""
+    with salida_con_prefijo(f"[{nombre_grupo}] "):
+        return procesar_grupo(nombre_grupo, lista_pdfs)
+
+
 def ejecutar_pipeline():
     """
     Ejecuta el pipeline completo:
@@ -596,8 +639,14 @@ def ejecutar_pipeline():
         "LIMITE_ERRORES": 0,
     }
     
-    for nombre_grupo, lista_pdfs in grupos.items():
-        resultado = procesar_grupo(nombre_grupo, lista_pdfs)
+    if GRUPOS_EN_PARALELO > 1 and len(grupos) > 1:
+        # Los grupos son independientes (archivos y rutas distintas)
+        with ProcessPoolExecutor(max_workers=min(GRUPOS_EN_PARALELO, len(grupos))) as executor:
+            estados = list(executor.map(_procesar_grupo_en_paralelo, grupos.keys(), grupos.values()))
+    else:
+        estados = [procesar_grupo(nombre_grupo, lista_pdfs) for nombre_grupo, lista_pdfs in grupos.items()]
+    
+    for resultado in estados:
         resultados[resultado] = resultados.get(resultado, 0) + 1
     
     # --- Resumen ---
@@ -621,4 +670,5 @@ def ejecutar_pipeline():
 # =============================================================================
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     ejecutar_pipeline()
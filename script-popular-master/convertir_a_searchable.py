@@ -15,10 +15,18 @@ import glob
 import os
 import sys
 import io
+import multiprocessing
 import subprocess
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 
+# pikepdf (qpdf) es opcional: une PDFs mas rapido que PyPDF2
+try:
+    import pikepdf
+    PIKEPDF_DISPONIBLE = True
+except ImportError:
+    PIKEPDF_DISPONIBLE = False
+
 # Configurar ruta de Tesseract si no esta en PATH
 TESSERACT_CMD = None
 TESSERACT_PATHS = [
@@ -27,6 +35,29 @@ TESSERACT_PATHS = [
     r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe',
 ]
 
+# Procesos simultaneos al convertir un PDF (cada uno renderiza y OCRiza un lote de paginas)
+OCR_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Maximo de paginas por llamada a Tesseract
+MAX_PAGINAS_POR_LOTE = 8
+
+# Memoria maxima de un lote: todas sus imagenes estan en memoria a la vez,
+# mas el TIFF sin comprimir que se le pasa a Tesseract por stdin (ancho x
+# alto x 3 bytes a 300 DPI, dos veces: ~50 MB por pagina carta). El tamano
+# del lote se reduce para que la pagina mas grande del PDF quepa.
+#
+# Memoria pico del OCR = OCR_WORKERS x MEMORIA_MAX_LOTE_MB por cada PDF que
+# se convierte a la vez: PDFS_EN_PARALELO en verificar_prestamos_v3.py,
+# GRUPOS_EN_PARALELO en pipeline.py. Con 8 CPUs y los valores por defecto,
+# 4 x 256 MB x 2 = 2 GB. Bajar cualquiera de los tres si falta memoria.
+MEMORIA_MAX_LOTE_MB = 256
+
+# Caracteres de texto nativo a partir de los cuales una pagina no se re-OCRiza
+MIN_CARACTERES_TEXTO_NATIVO = 200
+
+# Argumentos de Tesseract tras la imagen y la salida: idiomas y renderer PDF
+TESSERACT_ARGS = ('-l', 'spa+eng', 'pdf')
+
 for path in TESSERACT_PATHS:
     if os.path.exists(path):
         TESSERACT_CMD = path
@@ -34,42 +65,109 @@ for path in TESSERACT_PATHS:
         break
 
 
-def crear_pdf_ocr_con_tesseract(pil_image, output_pdf_path):
+def crear_pdf_ocr_lote(imagenes):
     """
-    Usa Tesseract directamente para crear un PDF con capa de texto OCR.
-    Este es el mismo metodo que usa OCRmyPDF internamente.
+    Ejecuta Tesseract una sola vez sobre varias imagenes PIL y retorna los
+    bytes del PDF generado, una pagina por imagen.
+    Evita pagar el arranque de Tesseract y la carga del modelo por cada pagina.
+    Las imagenes entran por stdin como un TIFF multipagina sin comprimir y el
+    PDF sale por stdout: no se escribe nada en disco.
     """
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Guardar imagen temporal
-        img_path = os.path.join(temp_dir, "page.png")
-        pil_image.save(img_path, format='PNG', dpi=(300, 300))
-        
-        # Ejecutar Tesseract para generar PDF
-        output_base = os.path.join(temp_dir, "output")
-        
-        cmd = [
-            TESSERACT_CMD,
-            img_path,
-            output_base,
-            '-l', 'spa+eng',
-            'pdf'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            raise Exception(f"Tesseract error: {result.stderr}")
-        
-        # Leer el PDF generado
-        generated_pdf = output_base + ".pdf"
-        with open(generated_pdf, 'rb') as f:
-            return f.read()
+    buffer = io.BytesIO()
+    imagenes[0].save(buffer, format='TIFF', save_all=True,
+                     append_images=imagenes[1:], dpi=(300, 300))
+    
+    cmd = [TESSERACT_CMD, 'stdin', 'stdout', *TESSERACT_ARGS]
+    
+    # Un hilo por proceso de Tesseract: el paralelismo lo dan los lotes
+    env = dict(os.environ)
+    env.setdefault('OMP_THREAD_LIMIT', '1')
+    result = subprocess.run(cmd, input=buffer.getbuffer(), capture_output=True, env=env)
+    
+    if result.returncode != 0:
+        raise Exception(f"Tesseract error: {result.stderr.decode(errors='replace')}")
+    
+    return result.stdout
+
+
+def _ocr_lote_de_paginas(pdf_entrada, paginas):
+    """
+    Renderiza las paginas indicadas y les aplica OCR con un solo Tesseract.
+    Corre en su propio proceso con su propio documento: pdfium no es
+    thread-safe, pero cada proceso tiene una instancia independiente.
+    """
+    pdf = pdfium.PdfDocument(pdf_entrada)
+    try:
+        imagenes = []
+        for i in paginas:
+            # Renderizar pagina como imagen (300 DPI para buen OCR)
+            scale = 300 / 72  # 300 DPI
+            bitmap = pdf[i].render(scale=scale)
+            imagenes.append(bitmap.to_pil())
+    finally:
+        pdf.close()
+    
+    return crear_pdf_ocr_lote(imagenes)
+
+
+def _como_archivo(origen):
+    """Bytes de un PDF -> objeto tipo archivo; una ruta se deja igual."""
+    return io.BytesIO(origen) if isinstance(origen, bytes) else origen
+
+
+def _unir_paginas(paginas, pdf_salida):
+    """
+    Escribe `pdf_salida` con las paginas indicadas, en orden.
+    `paginas` es una lista de (origen, indice_de_pagina); el origen es la
+    ruta de un PDF o los bytes de un PDF ya en memoria.
+    Usa pikepdf (qpdf, nativo) si esta instalado; si no, PyPDF2.
+    """
+    if PIKEPDF_DISPONIBLE:
+        # pikepdf necesita los originales abiertos hasta guardar el destino
+        origenes = {}
+        try:
+            with pikepdf.Pdf.new() as destino:
+                for origen, pos in paginas:
+                    if origen not in origenes:
+                        origenes[origen] = pikepdf.Pdf.open(_como_archivo(origen))
+                    destino.pages.append(origenes[origen].pages[pos])
+                destino.save(pdf_salida)
+        finally:
+            for origen in origenes.values():
+                origen.close()
+        return
+    
+    merger = PdfMerger()
+    lectores = {}
+    for origen, pos in paginas:
+        if origen not in lectores:
+            lectores[origen] = PdfReader(_como_archivo(origen))
+        merger.append(lectores[origen], pages=(pos, pos + 1))
+    with open(pdf_salida, 'wb') as output_file:
+        merger.write(output_file)
+    merger.close()
+
+
+def _bytes_por_pagina(page):
+    """Memoria que ocupa la pagina en un lote: imagen RGB a 300 DPI y su copia en el TIFF."""
+    ancho, alto = page.get_size()
+    return int(ancho * 300 / 72) * int(alto * 300 / 72) * 3 * 2
+
+
+def _pagina_tiene_texto_nativo(page):
+    """Indica si la pagina ya tiene suficiente texto seleccionable para omitir el OCR."""
+    textpage = page.get_textpage()
+    try:
+        return len(textpage.get_text_range().strip()) >= MIN_CARACTERES_TEXTO_NATIVO
+    finally:
+        textpage.close()
 
 
 def convertir_pdf_a_searchable(pdf_entrada, pdf_salida=None, forzar_ocr=False):
     """
     Convierte un PDF escaneado a un PDF con texto seleccionable.
     Usa Tesseract directamente para generar PDFs con OCR (igual que OCRmyPDF).
+    Las paginas que ya tienen texto nativo se copian tal cual, salvo con forzar_ocr=True.
     """
     if pdf_salida is None:
         base, ext = os.path.splitext(pdf_entrada)
@@ -83,41 +181,41 @@ def convertir_pdf_a_searchable(pdf_entrada, pdf_salida=None, forzar_ocr=False):
         pdf = pdfium.PdfDocument(pdf_entrada)
         num_paginas = len(pdf)
         
-        # Usar directorio temporal para paginas
-        with tempfile.TemporaryDirectory() as temp_dir:
-            pdf_paginas = []
-            
-            for i in range(num_paginas):
-                print(f"  Procesando pagina {i + 1}/{num_paginas}...", end=" ", flush=True)
-                
-                # Renderizar pagina como imagen (300 DPI para buen OCR)
-                page = pdf[i]
-                scale = 300 / 72  # 300 DPI
-                bitmap = page.render(scale=scale)
-                pil_image = bitmap.to_pil()
-                
-                # Generar PDF con OCR usando Tesseract
-                pdf_bytes = crear_pdf_ocr_con_tesseract(pil_image, None)
-                
-                # Guardar pagina temporal
-                pagina_path = os.path.join(temp_dir, f"pagina_{i}.pdf")
-                with open(pagina_path, 'wb') as f:
-                    f.write(pdf_bytes)
-                pdf_paginas.append(pagina_path)
-                
-                print("[OK]")
-            
-            pdf.close()
-            
-            # Combinar todas las paginas
-            merger = PdfMerger()
-            for pagina_path in pdf_paginas:
-                merger.append(pagina_path)
-            
-            # Guardar PDF final
-            with open(pdf_salida, 'wb') as output_file:
-                merger.write(output_file)
-            merger.close()
+        # Las paginas con texto nativo se copian del original; el resto va a OCR
+        paginas_ocr = []
+        bytes_pagina = 1
+        for i in range(num_paginas):
+            page = pdf[i]
+            if forzar_ocr or not _pagina_tiene_texto_nativo(page):
+                paginas_ocr.append(i)
+                bytes_pagina = max(bytes_pagina, _bytes_por_pagina(page))
+            else:
+                print(f"  Pagina {i + 1}/{num_paginas} [OK] (texto nativo, sin OCR)")
+        
+        pdf.close()
+        
+        # Repartir las paginas en lotes (uno por worker, sin pasar de
+        # MAX_PAGINAS_POR_LOTE ni de MEMORIA_MAX_LOTE_MB); cada lote se renderiza
+        # y pasa por Tesseract en un proceso del pool, en paralelo con los demas
+        max_por_lote = min(MAX_PAGINAS_POR_LOTE, MEMORIA_MAX_LOTE_MB * 1024 * 1024 // bytes_pagina)
+        tam_lote = max(1, min(max_por_lote, -(-len(paginas_ocr) // OCR_WORKERS)))
+        lotes = [paginas_ocr[k:k + tam_lote] for k in range(0, len(paginas_ocr), tam_lote)]
+        
+        if len(lotes) > 1:
+            with ProcessPoolExecutor(max_workers=min(OCR_WORKERS, len(lotes))) as executor:
+                pdfs_lotes = list(executor.map(_ocr_lote_de_paginas, [pdf_entrada] * len(lotes), lotes))
+        else:
+            pdfs_lotes = [_ocr_lote_de_paginas(pdf_entrada, lote) for lote in lotes]
+        
+        # Pagina -> (PDF del lote, posicion dentro del lote)
+        ubicacion = {}
+        for n, (lote, pdf_lote) in enumerate(zip(lotes, pdfs_lotes), 1):
+            for pos, p in enumerate(lote):
+                ubicacion[p] = (pdf_lote, pos)
+            print(f"  Lote {n}/{len(lotes)} (paginas {', '.join(str(p + 1) for p in lote)}) [OK]")
+        
+        # Combinar todas las paginas en su orden original y guardar el PDF final
+        _unir_paginas([ubicacion.get(i, (pdf_entrada, i)) for i in range(num_paginas)], pdf_salida)
         
         print(f"  [OK] Conversion exitosa!")
         size_original = os.path.getsize(pdf_entrada) / 1024 / 1024
@@ -177,6 +275,7 @@ def verificar_dependencias():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     # Verificar dependencias primero
     if not verificar_dependencias():
         print("[!] Algunas dependencias no estan instaladas.")
@@ -55,12 +55,89 @@ PALABRAS_CERTIFICACION = [
     "Authorize",
 ]
 
+# Patrones de detección por texto, compilados una sola vez al cargar el módulo
+_RE_FIRMA_COMPLETA = re.compile(
+    r'([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{3,40}?)\s*(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST)?)?)',
+    re.IGNORECASE
+)
+_RE_CONTEXTO_FIRMA = re.compile(r'(Firma|Certifico|Signed|Certify)', re.IGNORECASE)
+_RE_TIMESTAMP = re.compile(
+    r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST)?)?)'
+)
+# (palabra en minúsculas, patrón): la palabra permite descartar el regex con un `in`
+_RES_CERTIFICACION = [
+    (palabra.lower(), re.compile(
+        rf'{palabra}[^A-Z]{{0,50}}([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{{5,40}}?)(?:\d{{1,2}}/|\n|Firma|$)',
+        re.IGNORECASE
+    ))
+    for palabra in PALABRAS_CERTIFICACION
+]
+# Marca X antes o después de "Firma"/"Signature", en una sola pasada
+_RE_MARCA_X = re.compile(
+    r'[xX]{1,3}\s*(?:Firma|Signature|___|---)'
+    r'|(?:Firma|Signature)\s*[:\s]*[xX]{1,3}'
+)
+
 
 # =============================================================================
 # DETECCIÓN DE FIRMA MANUSCRITA (OpenCV)
 # =============================================================================
 
-def detectar_firma_manuscrita_en_area(page, area_texto="Firma", margen_arriba=100, margen_lados=50):
+# Flags que usa page.search_for por defecto: un TextPage compartido entre
+# varias búsquedas debe crearse con los mismos para dar los mismos resultados
+_FLAGS_BUSQUEDA = (
+    fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_WHITESPACE
+    | fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_MEDIABOX_CLIP
+)
+
+
+def _colapsar_espacios(texto):
+    """
+    Reemplaza cada tramo de espacios en blanco por un solo espacio.
+    Igual que re.sub(r'\\s+', ' ', texto) pero sin regex: los centinelas
+    conservan el espacio inicial/final que split() descartaría.
+    """
+    return ' '.join(('.' + texto + '.').split())[1:-1]
+
+
+def _pixmap_a_gris(pix):
+    """
+    Convierte un Pixmap de PyMuPDF a una imagen OpenCV en escala de grises,
+    leyendo los píxeles directamente (sin codificar/decodificar PNG).
+    """
+    img = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        return img[:, :, 0]
+    if pix.n == 4:
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2GRAY)
+    return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+
+def _area_en_blanco(page, rect):
+    """
+    True si nada de lo que MuPDF pinta en la página cae dentro de `rect`
+    (ni texto visible, ni imágenes, ni dibujos, ni anotaciones).
+    Un área así se renderiza en blanco: no tiene sentido generar el pixmap.
+    """
+    # bboxlog, anotaciones y widgets vienen sin rotar; `rect` está en el
+    # espacio de la página rotada (/Rotate), como el clip del render
+    rect = fitz.Rect(rect) * page.derotation_matrix
+    for tipo, bbox in page.get_bboxlog():
+        # Los recortes no pintan y el texto invisible (capa OCR) tampoco
+        if tipo.startswith("clip") or tipo == "ignore-text":
+            continue
+        if fitz.Rect(bbox).intersects(rect):
+            return False
+    for annot in page.annots():
+        if annot.rect.intersects(rect):
+            return False
+    for widget in page.widgets():
+        if widget.rect.intersects(rect):
+            return False
+    return True
+
+
+def detectar_firma_manuscrita_en_area(page, area_texto="Firma", margen_arriba=100, margen_lados=50, textpage=None):
     """
     Detecta si hay una firma manuscrita en el área cercana a un texto específico.
     Usa OpenCV para analizar si hay trazos/líneas en esa área.
@@ -70,6 +147,7 @@ def detectar_firma_manuscrita_en_area(page, area_texto="Firma", margen_arriba=10
         area_texto: Texto que indica dónde buscar la firma
         margen_arriba: Píxeles a buscar arriba del texto
         margen_lados: Píxeles a buscar a los lados
+        textpage: TextPage de la página (opcional, se crea si no se provee)
     
     Returns:
         (tiene_firma, confianza, descripcion)
@@ -78,13 +156,18 @@ def detectar_firma_manuscrita_en_area(page, area_texto="Firma", margen_arriba=10
         return None, 0, "OpenCV no disponible"
     
     try:
+        # Un solo TextPage para todas las búsquedas (cada search_for sin él
+        # vuelve a extraer el texto de la página)
+        if textpage is None:
+            textpage = page.get_textpage(flags=_FLAGS_BUSQUEDA)
+        
         # Buscar el área donde está el texto indicador
-        text_instances = page.search_for(area_texto)
+        text_instances = page.search_for(area_texto, textpage=textpage)
         
         if not text_instances:
             # Intentar con otras palabras clave
             for palabra in PALABRAS_AREA_FIRMA:
-                text_instances = page.search_for(palabra)
+                text_instances = page.search_for(palabra, textpage=textpage)
                 if text_instances:
                     break
         
@@ -109,20 +192,16 @@ def detectar_firma_manuscrita_en_area(page, area_texto="Firma", margen_arriba=10
         if firma_rect.is_empty:
             return None, 0, "Area de firma fuera de pagina"
         
+        # Sin nada pintado en el área no puede haber tinta: evitar el render
+        if _area_en_blanco(page, firma_rect):
+            return False, 10, "Area de firma vacia"
+        
         # Renderizar solo esa área como imagen
         mat = fitz.Matrix(3, 3)
-        pix = page.get_pixmap(matrix=mat, clip=firma_rect)
-        
-        # Convertir a formato OpenCV
-        img_data = pix.tobytes("png")
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        pix = page.get_pixmap(matrix=mat, clip=firma_rect, colorspace=fitz.csGRAY)
         
-        if img is None:
-            return None, 0, "Error al procesar imagen"
-        
-        # Convertir a escala de grises
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Convertir a escala de grises para OpenCV
+        gray = _pixmap_a_gris(pix)
         
         # Aplicar umbral para detectar tinta
         _, thresh = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
@@ -172,25 +251,16 @@ def detectar_firma_manuscrita_pagina_completa(page):
             page_rect.y1
         )
         
-        mat = fitz.Matrix(2, 2)
-        pix = page.get_pixmap(matrix=mat, clip=firma_rect)
-        
-        img_data = pix.tobytes("png")
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if _area_en_blanco(page, firma_rect):
+            return False, 10, "No se detectaron firmas manuscritas"
         
-        if img is None:
-            return None, 0, "Error al procesar imagen"
+        mat = fitz.Matrix(2, 2)
+        pix = page.get_pixmap(matrix=mat, clip=firma_rect, colorspace=fitz.csGRAY)
         
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = _pixmap_a_gris(pix)
         _, thresh = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
         
-        # Detectar líneas horizontales (líneas de firma)
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (50, 1))
-        lineas = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-        num_lineas = cv2.countNonZero(lineas) > 100
-        
-        # Detectar trazos sobre las líneas
+        # Detectar trazos en el área inferior
         contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         contornos_firma = [c for c in contours if 50 < cv2.contourArea(c) < 5000]
         
@@ -216,12 +286,14 @@ def detectar_firma_electronica(texto):
         (tiene_firma, tipo, detalle)
     """
     # Normalizar texto
-    texto_norm = re.sub(r'\s+', ' ', texto)
+    # Sin "/" y ":" no puede haber fecha + hora
+    if '/' not in texto or ':' not in texto:
+        return False, None, None
     
-    # Patrón 1: NOMBRE + fecha + hora + AM/PM + timezone
-    patron_completo = r'([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{3,40}?)\s*(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST)?)?)'
+    texto_norm = _colapsar_espacios(texto)
     
-    match = re.search(patron_completo, texto_norm, re.IGNORECASE)
+    # Patrón 1: NOMBRE + fecha + hora + AM/PM + timezone
+    match = _RE_FIRMA_COMPLETA.search(texto_norm)
     if match:
         nombre = match.group(1).strip()
         fecha = match.group(2)
@@ -230,9 +302,8 @@ def detectar_firma_electronica(texto):
             return True, "Firma Electronica (Timestamp)", f"{nombre} - {fecha} {hora}"
     
     # Patrón 2: Solo fecha + hora cerca de "Firma" o "Certifico"
-    if re.search(r'(Firma|Certifico|Signed|Certify)', texto_norm, re.IGNORECASE):
-        patron_timestamp = r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST)?)?)'
-        match_ts = re.search(patron_timestamp, texto_norm)
+    if _RE_CONTEXTO_FIRMA.search(texto_norm):
+        match_ts = _RE_TIMESTAMP.search(texto_norm)
         if match_ts:
             return True, "Firma Electronica (Timestamp)", match_ts.group(1)
     
@@ -250,12 +321,14 @@ def detectar_firma_texto(texto):
     Returns:
         (tiene_firma, tipo, detalle)
     """
-    texto_norm = re.sub(r'\s+', ' ', texto)
+    texto_norm = _colapsar_espacios(texto)
+    texto_lower = texto.lower()
     
     # Buscar nombre después de palabras de certificación
-    for palabra in PALABRAS_CERTIFICACION:
-        patron = rf'{palabra}[^A-Z]{{0,50}}([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{{5,40}}?)(?:\d{{1,2}}/|\n|Firma|$)'
-        match = re.search(patron, texto_norm, re.IGNORECASE)
+    for palabra, patron in _RES_CERTIFICACION:
+        if palabra not in texto_lower:
+            continue
+        match = patron.search(texto_norm)
         if match:
             nombre = match.group(1).strip()
             if len(nombre) > 5 and not any(p in nombre.upper() for p in ['DOCUMENTO', 'SEGURO', 'TITULO']):
@@ -275,10 +348,7 @@ def detectar_marca_x(texto):
     Returns:
         (tiene_firma, tipo, detalle)
     """
-    if re.search(r'[xX]{1,3}\s*(?:Firma|Signature|___|---)', texto):
-        return True, "Firma con Marca X", "Marca X detectada"
-    
-    if re.search(r'(?:Firma|Signature)\s*[:\s]*[xX]{1,3}', texto):
+    if ('x' in texto or 'X' in texto) and _RE_MARCA_X.search(texto):
         return True, "Firma con Marca X", "Marca X detectada"
     
     return False, None, None
@@ -349,9 +419,13 @@ def detectar_firma_en_pagina(page, texto=None):
     
     # 4. Intentar detectar firma manuscrita (si hay área de firma identificada)
     if OPENCV_DISPONIBLE:
+        texto_lower = texto.lower()
+        textpage = None
         for palabra in PALABRAS_AREA_FIRMA:
-            if palabra.lower() in texto.lower():
-                tiene_firma, confianza, detalle = detectar_firma_manuscrita_en_area(page, palabra)
+            if palabra.lower() in texto_lower:
+                if textpage is None:
+                    textpage = page.get_textpage(flags=_FLAGS_BUSQUEDA)
+                tiene_firma, confianza, detalle = detectar_firma_manuscrita_en_area(page, palabra, textpage=textpage)
                 if tiene_firma and confianza > 40:
                     resultado.update({
                         "firma_detectada": True,
@@ -11,26 +11,27 @@ Uso:
 import fitz  # PyMuPDF
 import re
 import json
-import glob
+import errno
+import hashlib
+import io
+import multiprocessing
 import os
 import sys
 import argparse
+import contextlib
 import traceback
 import shutil
 import time
-import subprocess
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from glob import glob
 
-# Intentar importar dependencias de OCR
+# Intentar importar el OCR de convertir_a_searchable.py
+# (requiere pypdfium2, pytesseract, Pillow y PyPDF2)
 try:
-    import pypdfium2 as pdfium
-    from PIL import Image
-    from PyPDF2 import PdfReader, PdfWriter, PdfMerger
-    import pytesseract
+    from convertir_a_searchable import TESSERACT_CMD, convertir_pdf_a_searchable
     OCR_DISPONIBLE = True
 except ImportError:
+    TESSERACT_CMD = None
     OCR_DISPONIBLE = False
 
 # Intentar importar OpenCV para detección de firmas manuscritas
@@ -41,6 +42,20 @@ try:
 except ImportError:
     OPENCV_DISPONIBLE = False
 
+# Intentar importar orjson para serializar reportes JSON más rápido
+try:
+    import orjson
+    ORJSON_DISPONIBLE = True
+except ImportError:
+    ORJSON_DISPONIBLE = False
+
+# Intentar importar pikepdf (qpdf) para unir PDFs más rápido que PyPDF2
+try:
+    import pikepdf
+    PIKEPDF_DISPONIBLE = True
+except ImportError:
+    PIKEPDF_DISPONIBLE = False
+
 # =============================================================================
 # FUNCIONES AUXILIARES REUSABLES (exportadas)
 # =============================================================================
@@ -56,6 +71,21 @@ def merge_pdfs(file_list, output_path):
     except Exception:
         raise RuntimeError("PyPDF2 no disponible: instala PyPDF2 para poder unir PDFs")
 
+    if PIKEPDF_DISPONIBLE:
+        # pikepdf necesita los originales abiertos hasta guardar el destino
+        origenes = []
+        try:
+            with pikepdf.Pdf.new() as destino:
+                for p in file_list:
+                    origen = pikepdf.Pdf.open(p)
+                    origenes.append(origen)
+                    destino.pages.extend(origen.pages)
+                destino.save(output_path)
+        finally:
+            for origen in origenes:
+                origen.close()
+        return
+
     merger = PdfMerger()
     for p in file_list:
         merger.append(p)
@@ -63,6 +93,16 @@ def merge_pdfs(file_list, output_path):
         merger.write(fout)
     merger.close()
 
+
+def json_a_bytes(obj):
+    """
+    Serializa `obj` a JSON indentado (2 espacios) en UTF-8.
+    Usa orjson si está instalado; si no, cae a la librería estándar.
+    """
+    if ORJSON_DISPONIBLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
 # =============================================================================
 # CONFIGURACIÓN DEL PIPELINE
 # =============================================================================
@@ -86,24 +126,17 @@ MAX_ERRORES = 3
 # Tiempo máximo para archivos .tmp huérfanos (en segundos)
 MAX_EDAD_TMP = 3600  # 1 hora
 
-# =============================================================================
-# CONFIGURACIÓN DE TESSERACT OCR
-# =============================================================================
-
-TESSERACT_CMD = None
-TESSERACT_PATHS = [
-    r'C:\Users\PR65368\AppData\Local\Programs\Tesseract-OCR\tesseract.exe',
-    r'C:\Program Files\Tesseract-OCR\tesseract.exe',
-    r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe',
-]
+# PDFs que el pipeline procesa a la vez, cada uno en su propio proceso.
+# El OCR de cada PDF ya usa OCR_WORKERS procesos de Tesseract; memoria pico
+# en MEMORIA_MAX_LOTE_MB (convertir_a_searchable.py).
+PDFS_EN_PARALELO = 2
 
-# Buscar Tesseract en las rutas conocidas
-for path in TESSERACT_PATHS:
-    if os.path.exists(path):
-        TESSERACT_CMD = path
-        if OCR_DISPONIBLE:
-            pytesseract.pytesseract.tesseract_cmd = path
-        break
+# Caché de reportes del modo legacy, indexada por el SHA-1 de cada PDF
+# (un PDF que no cambió entre corridas no se vuelve a verificar).
+# Subir CACHE_VERSION al cambiar la extracción o las validaciones: los
+# reportes guardados con otra versión dejan de usarse.
+CARPETA_CACHE = ".cache_verificacion"
+CACHE_VERSION = 1
 
 # =============================================================================
 # CONFIGURACIÓN DE TIPOS DE DOCUMENTO
@@ -260,127 +293,90 @@ TIPOS_DOCUMENTO = {
     },
 }
 
+# Compilar una sola vez los patrones de extracción de cada campo
+# (las lógicas especiales como "DETECTAR_TIPO" se dejan como texto)
+# y precalcular los identificadores en mayúsculas para detectar_tipo_documento
+for _config in TIPOS_DOCUMENTO.values():
+    _config["_identificadores_upper"] = tuple(i.upper() for i in _config["identificadores"])
+    _config["_negativos_upper"] = tuple(n.upper() for n in _config.get("identificadores_negativos", []))
+    for _campo, _patrones in _config["campos"].items():
+        if not isinstance(_patrones, str):
+            _config["campos"][_campo] = [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in _patrones]
+
 # =============================================================================
-# FUNCIONES DE OCR (copiadas de convertir_a_searchable.py)
+# FUNCIONES DE UTILIDAD
 # =============================================================================
 
-def crear_pdf_ocr_con_tesseract(pil_image, output_pdf_path):
+class _SalidaConPrefijo(io.TextIOBase):
     """
-    Usa Tesseract directamente para crear un PDF con capa de texto OCR.
-    Este es el mismo método que usa OCRmyPDF internamente.
+    Flujo de texto que reenvía a `destino` cada línea completa precedida de
+    `prefijo`, en una sola escritura por tanda de líneas.
     """
-    if not OCR_DISPONIBLE or not TESSERACT_CMD:
-        raise Exception("OCR no disponible: faltan dependencias o Tesseract no encontrado")
     
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Guardar imagen temporal
-        img_path = os.path.join(temp_dir, "page.png")
-        pil_image.save(img_path, format='PNG', dpi=(300, 300))
-        
-        # Ejecutar Tesseract para generar PDF
-        output_base = os.path.join(temp_dir, "output")
-        
-        cmd = [
-            TESSERACT_CMD,
-            img_path,
-            output_base,
-            '-l', 'spa+eng',
-            'pdf'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            raise Exception(f"Tesseract error: {result.stderr}")
-        
-        # Leer el PDF generado
-        generated_pdf = output_base + ".pdf"
-        with open(generated_pdf, 'rb') as f:
-            return f.read()
-
-
-def convertir_pdf_a_searchable(pdf_entrada, pdf_salida=None, forzar_ocr=False):
-    """
-    Convierte un PDF escaneado a un PDF con texto seleccionable.
-    Usa Tesseract directamente para generar PDFs con OCR (igual que OCRmyPDF).
-    """
-    if not OCR_DISPONIBLE:
-        raise Exception("OCR no disponible: faltan dependencias (pypdfium2, pytesseract, PIL, PyPDF2)")
+    def __init__(self, destino, prefijo):
+        self._destino = destino
+        self._prefijo = prefijo
+        self._pendiente = ""
     
-    if not TESSERACT_CMD:
-        raise Exception("Tesseract OCR no encontrado en las rutas conocidas")
+    def writable(self):
+        return True
     
-    if pdf_salida is None:
-        base, ext = os.path.splitext(pdf_entrada)
-        pdf_salida = f"{base}_OCR{ext}"
+    def write(self, texto):
+        lineas = (self._pendiente + texto).split("\n")
+        self._pendiente = lineas.pop()
+        if lineas:
+            self._destino.write("".join(f"{self._prefijo}{linea}\n" for linea in lineas))
+            self._destino.flush()
+        return len(texto)
     
-    print(f"Procesando: {pdf_entrada}")
-    print(f"  Salida: {pdf_salida}")
+    def flush(self):
+        self._destino.flush()
     
+    def terminar(self):
+        """Escribe lo que quedó sin salto de línea final."""
+        if self._pendiente:
+            self.write("\n")
+
+
+@contextlib.contextmanager
+def salida_con_prefijo(prefijo):
+    """
+    Antepone `prefijo` a cada línea impresa (stdout y stderr) dentro del
+    bloque, para distinguir la salida de tareas que corren en paralelo.
+    """
+    salida = _SalidaConPrefijo(sys.stdout, prefijo)
+    errores = _SalidaConPrefijo(sys.stderr, prefijo)
     try:
-        # Abrir PDF con pypdfium2
-        pdf = pdfium.PdfDocument(pdf_entrada)
-        num_paginas = len(pdf)
-        
-        # Usar directorio temporal para páginas
-        with tempfile.TemporaryDirectory() as temp_dir:
-            pdf_paginas = []
-            
-            for i in range(num_paginas):
-                print(f"  Procesando página {i + 1}/{num_paginas}...", end=" ", flush=True)
-                
-                # Renderizar página como imagen (300 DPI para buen OCR)
-                page = pdf[i]
-                scale = 300 / 72  # 300 DPI
-                bitmap = page.render(scale=scale)
-                pil_image = bitmap.to_pil()
-                
-                # Generar PDF con OCR usando Tesseract
-                pdf_bytes = crear_pdf_ocr_con_tesseract(pil_image, None)
-                
-                # Guardar página temporal
-                pagina_path = os.path.join(temp_dir, f"pagina_{i}.pdf")
-                with open(pagina_path, 'wb') as f:
-                    f.write(pdf_bytes)
-                pdf_paginas.append(pagina_path)
-                
-                print("[OK]")
-            
-            pdf.close()
-            
-            # Combinar todas las páginas
-            merger = PdfMerger()
-            for pagina_path in pdf_paginas:
-                merger.append(pagina_path)
-            
-            # Guardar PDF final
-            with open(pdf_salida, 'wb') as output_file:
-                merger.write(output_file)
-            merger.close()
-        
-        print(f"  [OK] Conversión exitosa!")
-        size_original = os.path.getsize(pdf_entrada) / 1024 / 1024
-        size_nuevo = os.path.getsize(pdf_salida) / 1024 / 1024
-        print(f"  Tamaño: {size_original:.2f} MB -> {size_nuevo:.2f} MB")
-        return pdf_salida
-        
-    except Exception as e:
-        print(f"\n  [X] Error: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        with contextlib.redirect_stdout(salida), contextlib.redirect_stderr(errores):
+            yield
+    finally:
+        salida.terminar()
+        errores.terminar()
+
+
+def _colapsar_espacios(texto):
+    """
+    Reemplaza cada tramo de espacios en blanco por un solo espacio.
+    Igual que re.sub(r'\\s+', ' ', texto) pero sin regex: los centinelas
+    conservan el espacio inicial/final que split() descartaría.
+    """
+    return ' '.join(('.' + texto + '.').split())[1:-1]
+
+
+# Patrones reutilizados, compilados una sola vez al cargar el módulo
+_RE_ESPACIOS = re.compile(r'\s+')
+_RE_EMAIL = re.compile(r'([\w\.\-]+@[\w\.\-]+\.[a-z]{2,})', re.IGNORECASE)
+_RE_ZIPCODE = re.compile(r'\b(\d{5})\b')
+_RE_ESTADO = re.compile(r'\b([A-Z]{2})\b')
+_RE_ESTADO_PR = re.compile(r'\b(PR|[A-Z]{2})\b')
 
-# =============================================================================
-# FUNCIONES DE UTILIDAD
-# =============================================================================
 
 def limpiar(texto):
     """Limpia texto de caracteres extra."""
     if not texto:
         return ""
-    texto = re.sub(r'\s+', ' ', texto)
-    texto = texto.strip()
-    return texto
+    # split() sin argumentos ya colapsa cualquier espacio Unicode y recorta extremos
+    return ' '.join(texto.split())
 
 
 def formatear_precio(valor):
@@ -403,9 +399,9 @@ def limpiar_email(contenido):
         return None
     # Limpiar caracteres de OCR problemáticos
     contenido = contenido.replace('|', '').strip()
-    contenido = re.sub(r'\s+', '', contenido)
+    contenido = _RE_ESPACIOS.sub('', contenido)
     # Extraer email
-    match = re.search(r'([\w\.\-]+@[\w\.\-]+\.[a-z]{2,})', contenido, re.IGNORECASE)
+    match = _RE_EMAIL.search(contenido)
     if match:
         return match.group(1).lower()
     return contenido.lower() if '@' in contenido else None
@@ -425,6 +421,13 @@ MUNICIPIOS_PR = {
     "Yabucoa","Yauco"
 }
 
+# Municipios indexados por su forma en mayúsculas y compilados en una sola
+# alternación (los más largos primero) para localizarlos en una pasada.
+_MUNICIPIOS_POR_NOMBRE = {m.upper(): m for m in MUNICIPIOS_PR}
+_MUNICIPIOS_RE = re.compile(
+    r'\b(' + '|'.join(re.escape(m) for m in sorted(_MUNICIPIOS_POR_NOMBRE, key=len, reverse=True)) + r')\b'
+)
+
 
 def parse_full_name(full_name):
     """Divide un nombre completo en `nombre`, `middle_name`, `apellidos`.
@@ -456,15 +459,16 @@ def parse_address(address_line):
         return {"address": None, "city": None, "state": None, "zipcode": None}
     txt = limpiar(address_line)
     zipcode = None
-    m_zip = re.search(r'\b(\d{5})\b', txt)
+    m_zip = _RE_ZIPCODE.search(txt)
     if m_zip:
         zipcode = m_zip.group(1)
     # estado (buscar PR u otra sigla cercana al zipcode)
     state = None
-    if ' PR ' in f" {txt.upper()} " or txt.upper().endswith(' PR') or ', PR' in txt.upper():
+    txt_upper = txt.upper()
+    if ' PR ' in f" {txt_upper} " or txt_upper.endswith(' PR') or ', PR' in txt_upper:
         state = 'PR'
     else:
-        m_state = re.search(r'\b([A-Z]{2})\b', txt.upper())
+        m_state = _RE_ESTADO.search(txt_upper)
         if m_state:
             state = m_state.group(1)
 
@@ -477,7 +481,7 @@ def parse_address(address_line):
     if zipcode:
         pre = txt[:txt.rfind(zipcode)].strip().rstrip(',')
     elif state:
-        m_state = re.search(r'\b(PR|[A-Z]{2})\b', txt.upper())
+        m_state = _RE_ESTADO_PR.search(txt_upper)
         if m_state:
             pre = txt[:m_state.start()].strip().rstrip(',')
 
@@ -485,16 +489,11 @@ def parse_address(address_line):
         # Buscar coincidencia de municipio al final de 'pre'
         pre_upper = pre.upper()
         found_munic = None
-        # Ordenar municipios por longitud descendente para evitar coincidencias parciales
-        for m in sorted(MUNICIPIOS_PR, key=lambda x: -len(x)):
-            # buscar coincidencia como palabra completa en cualquier parte de 'pre'
-            if re.search(r'\b' + re.escape(m.upper()) + r'\b', pre_upper):
-                found_munic = m
-                break
-            # también permitir que venga separado por coma al final
-            if ',' in pre and pre_upper.split(',')[-1].strip() == m.upper():
-                found_munic = m
-                break
+        # Buscar todos los municipios como palabra completa en una sola pasada;
+        # si aparecen varios, gana el más largo para evitar coincidencias parciales
+        encontrados = _MUNICIPIOS_RE.findall(pre_upper)
+        if encontrados:
+            found_munic = _MUNICIPIOS_POR_NOMBRE[max(encontrados, key=len)]
 
         if found_munic:
             city = found_munic
@@ -549,16 +548,15 @@ def detectar_tipo_documento(texto):
     texto_upper = texto.upper()
     
     for tipo, config in TIPOS_DOCUMENTO.items():
-        # Verificar identificadores negativos primero
-        negativos = config.get("identificadores_negativos", [])
-        tiene_negativo = any(neg.upper() in texto_upper for neg in negativos)
+        # Verificar identificadores positivos (ya en mayúsculas)
+        if not any(ident in texto_upper for ident in config["_identificadores_upper"]):
+            continue
         
-        # Verificar identificadores positivos
-        identificadores = config["identificadores"]
-        tiene_positivo = any(ident.upper() in texto_upper for ident in identificadores)
+        # Descartar si tiene algún identificador negativo
+        if any(neg in texto_upper for neg in config["_negativos_upper"]):
+            continue
         
-        if tiene_positivo and not tiene_negativo:
-            return tipo
+        return tipo
     
     return None
 
@@ -571,13 +569,16 @@ def extraer_campo(texto, patrones):
     """
     Extrae un valor del texto usando una lista de patrones regex.
     Intenta cada patrón en orden hasta encontrar una coincidencia.
+    Acepta patrones ya compilados (TIPOS_DOCUMENTO) o como texto.
     """
     if isinstance(patrones, str):
         # Es una lógica especial, no un patrón
         return None
     
     for patron in patrones:
-        match = re.search(patron, texto, re.IGNORECASE | re.MULTILINE)
+        if isinstance(patron, str):
+            patron = re.compile(patron, re.IGNORECASE | re.MULTILINE)
+        match = patron.search(texto)
         if match:
             valor = limpiar(match.group(1))
             if valor:
@@ -620,69 +621,71 @@ def detectar_tipo_propiedad(texto):
     return "INDETERMINADO"
 
 
+_RE_FECHA_TEXTO = re.compile(
+    r'(\d{1,2}\s+de\s+(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre)\s+de\s+\d{4})',
+    re.IGNORECASE
+)
+_RE_FECHA_NUM = re.compile(r'(\d{1,2}/\d{1,2}/\d{4})')
+
+
 def extraer_ultima_fecha(texto):
     """
     Extrae la última fecha en formato "DD de MES de YYYY".
     Esta es típicamente la fecha del documento (después de POR:).
     """
-    patron = r'(\d{1,2}\s+de\s+(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre)\s+de\s+\d{4})'
-    fechas = re.findall(patron, texto, re.IGNORECASE)
+    fechas = _RE_FECHA_TEXTO.findall(texto)
     
     if fechas:
         return fechas[-1]  # Última fecha encontrada
     
     # Fallback: fecha numérica
-    patron_num = r'(\d{1,2}/\d{1,2}/\d{4})'
-    fechas_num = re.findall(patron_num, texto)
+    fechas_num = _RE_FECHA_NUM.findall(texto)
     if fechas_num:
         return fechas_num[-1]
     
     return None
 
 
-# Variable global para almacenar texto de continuaciones (se usa en procesar_paquete)
-_texto_continuaciones_estudio = ""
-
-
-def extraer_ultima_fecha_estudio(texto):
+def extraer_ultima_fecha_estudio(texto, continuaciones=""):
     """
     Extrae la última fecha del estudio de título.
-    Busca también en las páginas de continuación.
+    Busca también en las páginas de continuación (`continuaciones`).
     """
-    global _texto_continuaciones_estudio
-    
     # Combinar texto del estudio principal con continuaciones
-    texto_completo = texto + "\n" + _texto_continuaciones_estudio
+    texto_completo = texto + "\n" + continuaciones
     
     return extraer_ultima_fecha(texto_completo)
 
 
+_RES_LINEA_RECHAZO = [
+    re.compile(r'que\s+no\s+desea\s+que\s+Popular[^:]*gestione[:\s]*([^\n]{0,100})', re.IGNORECASE),
+    re.compile(r'favor\s+indicar\s+el\s+seguro\s+que\s+no\s+desea[^:]*:[:\s]*([^\n]{0,100})', re.IGNORECASE),
+    re.compile(r'Insurance\s+gestione[:\s]*([^\n]{0,100})', re.IGNORECASE),
+]
+_RE_RELLENO_LINEA = re.compile(r'[_\-\.\s\n:]+')
+
+
 def verificar_linea_rechazo(texto):
     """
     Verifica si la línea de rechazo de seguros está en blanco.
     Retorna el estado de la verificación.
     """
-    patrones = [
-        r'que\s+no\s+desea\s+que\s+Popular[^:]*gestione[:\s]*([^\n]{0,100})',
-        r'favor\s+indicar\s+el\s+seguro\s+que\s+no\s+desea[^:]*:[:\s]*([^\n]{0,100})',
-        r'Insurance\s+gestione[:\s]*([^\n]{0,100})',
-    ]
-    
     texto_formulario = [
         "firma del solicitante", "firma del co-solicitante", "firma", 
         "solicitante", "co-solicitante", "fecha", "mortg", "rev"
     ]
     
-    for patron in patrones:
-        match = re.search(patron, texto, re.IGNORECASE)
+    for patron in _RES_LINEA_RECHAZO:
+        match = patron.search(texto)
         if match:
             contenido = (match.group(1) or "").strip()
-            contenido_limpio = re.sub(r'[_\-\.\s\n:]+', '', contenido).lower()
+            contenido_limpio = _RE_RELLENO_LINEA.sub('', contenido).lower()
             
             if not contenido_limpio or len(contenido_limpio) < 3:
                 return "CORRECTO (Está en blanco)"
             
-            es_formulario = any(txt in contenido.lower() for txt in texto_formulario)
+            contenido_lower = contenido.lower()
+            es_formulario = any(txt in contenido_lower for txt in texto_formulario)
             if es_formulario:
                 return "CORRECTO (Está en blanco)"
             else:
@@ -691,10 +694,56 @@ def verificar_linea_rechazo(texto):
     return "NO LOCALIZADO"
 
 
-def detectar_firma_manuscrita_en_area(page, area_texto="Firma del Solicitante"):
+# Flags que usa page.search_for por defecto: un TextPage compartido entre
+# varias búsquedas debe crearse con los mismos para dar los mismos resultados
+_FLAGS_BUSQUEDA = (
+    fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_WHITESPACE
+    | fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_MEDIABOX_CLIP
+)
+
+
+def _pixmap_a_gris(pix):
+    """
+    Convierte un Pixmap de PyMuPDF a una imagen OpenCV en escala de grises,
+    leyendo los píxeles directamente (sin codificar/decodificar PNG).
+    """
+    img = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        return img[:, :, 0]
+    if pix.n == 4:
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2GRAY)
+    return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+
+def _area_en_blanco(page, rect):
+    """
+    True si nada de lo que MuPDF pinta en la página cae dentro de `rect`
+    (ni texto visible, ni imágenes, ni dibujos, ni anotaciones).
+    Un área así se renderiza en blanco: no tiene sentido generar el pixmap.
+    """
+    # bboxlog, anotaciones y widgets vienen sin rotar; `rect` está en el
+    # espacio de la página rotada (/Rotate), como el clip del render
+    rect = fitz.Rect(rect) * page.derotation_matrix
+    for tipo, bbox in page.get_bboxlog():
+        # Los recortes no pintan y el texto invisible (capa OCR) tampoco
+        if tipo.startswith("clip") or tipo == "ignore-text":
+            continue
+        if fitz.Rect(bbox).intersects(rect):
+            return False
+    for annot in page.annots():
+        if annot.rect.intersects(rect):
+            return False
+    for widget in page.widgets():
+        if widget.rect.intersects(rect):
+            return False
+    return True
+
+
+def detectar_firma_manuscrita_en_area(page, area_texto="Firma del Solicitante", textpage=None):
     """
     Detecta si hay una firma manuscrita en el área cercana a un texto específico.
     Usa OpenCV para analizar si hay trazos/líneas en esa área.
+    `textpage` permite reutilizar el TextPage de la página entre llamadas.
     
     Returns:
         (tiene_firma, confianza, descripcion)
@@ -704,7 +753,7 @@ def detectar_firma_manuscrita_en_area(page, area_texto="Firma del Solicitante"):
     
     try:
         # Buscar el área donde dice "Firma del Solicitante"
-        text_instances = page.search_for(area_texto)
+        text_instances = page.search_for(area_texto, textpage=textpage)
         
         if not text_instances:
             return None, 0, "Área de firma no encontrada"
@@ -728,21 +777,17 @@ def detectar_firma_manuscrita_en_area(page, area_texto="Firma del Solicitante"):
         if firma_rect.is_empty:
             return None, 0, "Área de firma fuera de página"
         
+        # Sin nada pintado en el área no puede haber tinta: evitar el render
+        if _area_en_blanco(page, firma_rect):
+            return False, 10, "Area de firma vacia"
+        
         # Renderizar solo esa área como imagen
         mat = fitz.Matrix(3, 3)  # 3x zoom para mejor detección
         clip = firma_rect
-        pix = page.get_pixmap(matrix=mat, clip=clip)
-        
-        # Convertir a formato OpenCV
-        img_data = pix.tobytes("png")
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY)
         
-        if img is None:
-            return None, 0, "Error al procesar imagen"
-        
-        # Convertir a escala de grises
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Convertir a formato OpenCV en escala de grises
+        gray = _pixmap_a_gris(pix)
         
         # Aplicar umbral para detectar tinta (líneas oscuras)
         _, thresh = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
@@ -794,25 +839,16 @@ def detectar_firma_manuscrita_pagina_completa(page):
             page_rect.y1
         )
         
-        mat = fitz.Matrix(2, 2)
-        pix = page.get_pixmap(matrix=mat, clip=firma_rect)
-        
-        img_data = pix.tobytes("png")
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if _area_en_blanco(page, firma_rect):
+            return False, 10, "No se detectaron firmas manuscritas"
         
-        if img is None:
-            return None, 0, "Error al procesar imagen"
+        mat = fitz.Matrix(2, 2)
+        pix = page.get_pixmap(matrix=mat, clip=firma_rect, colorspace=fitz.csGRAY)
         
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = _pixmap_a_gris(pix)
         _, thresh = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
         
-        # Detectar líneas horizontales (líneas de firma)
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (50, 1))
-        lineas = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-        num_lineas = cv2.countNonZero(lineas) > 100
-        
-        # Detectar trazos sobre las líneas
+        # Detectar trazos en el área inferior
         contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         contornos_firma = [c for c in contours if 50 < cv2.contourArea(c) < 5000]
         
@@ -859,6 +895,34 @@ PALABRAS_CERTIFICACION = [
     "Confirm",
 ]
 
+# Patrones de detectar_firma, compilados una sola vez
+_RE_FIRMA_TIMESTAMP = re.compile(
+    r'([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{3,40}?)\s*(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST|UTC)?)?)',
+    re.IGNORECASE
+)
+_RE_CONTEXTO_FIRMA = re.compile(
+    '(' + '|'.join(PALABRAS_AREA_FIRMA + PALABRAS_CERTIFICACION) + ')', re.IGNORECASE
+)
+_RE_TIMESTAMP_SOLO = re.compile(
+    r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST|UTC)?)?)'
+)
+# (palabra en minúsculas, patrón): la palabra permite descartar el regex con un `in`
+_RES_CERTIFICACION = [
+    (palabra.lower(), re.compile(
+        rf'{palabra}[^A-Z]{{0,100}}([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{{5,40}}?)(?:\d{{1,2}}/|\n|Firma|$)',
+        re.IGNORECASE
+    ))
+    for palabra in PALABRAS_CERTIFICACION
+]
+# Marca X antes o después de "Firma"/"Signature", en una sola pasada
+_RE_MARCA_X = re.compile(
+    r'[xX]{1,3}\s*(?:Firma|Signature|___|---)'
+    r'|(?:Firma|Signature)\s*[:\s]*[xX]{1,3}'
+)
+# Palabras que indican que el "nombre" capturado es texto del documento
+_EXCLUIR_NOMBRE_TIMESTAMP = ('DOCUMENTO', 'SEGURO', 'TITULO', 'BANCO', 'NUMERO', 'FECHA', 'PAGINA')
+_EXCLUIR_NOMBRE_CERTIFICACION = ('DOCUMENTO', 'SEGURO', 'TITULO', 'BANCO', 'DIVULGACIONES', 'PRESENTADAS')
+
 
 def detectar_firma(texto, page=None):
     """
@@ -879,28 +943,28 @@ def detectar_firma(texto, page=None):
         - Firma de Texto: Nombre escrito en área de firma
     """
     # Normalizar texto (quitar saltos de línea extras para mejor detección)
-    texto_norm = re.sub(r'\s+', ' ', texto)
+    texto_norm = _colapsar_espacios(texto)
+    texto_lower = texto.lower()
+    # Los patrones de timestamp necesitan "/" y ":"; si faltan no se evalúan
+    puede_tener_timestamp = '/' in texto and ':' in texto
     
     # =========================================================================
     # PATRÓN 1: Firma electrónica con timestamp completo
     # Ejemplo: "JUAN PEREZ GARCIA 10/10/2025 7:29 AM PDT"
     # =========================================================================
-    patron_timestamp = r'([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{3,40}?)\s*(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST|UTC)?)?)'
-    match_ts = re.search(patron_timestamp, texto_norm, re.IGNORECASE)
+    match_ts = _RE_FIRMA_TIMESTAMP.search(texto_norm) if puede_tener_timestamp else None
     if match_ts:
         nombre = match_ts.group(1).strip()
+        nombre_upper = nombre.upper()
         # Validar que sea un nombre real (no texto del documento)
-        palabras_excluir = ['DOCUMENTO', 'SEGURO', 'TITULO', 'BANCO', 'NUMERO', 'FECHA', 'PAGINA']
-        if len(nombre) > 5 and not any(p in nombre.upper() for p in palabras_excluir):
+        if len(nombre) > 5 and not any(p in nombre_upper for p in _EXCLUIR_NOMBRE_TIMESTAMP):
             return True, "Firma Electronica (Timestamp)", f"{nombre} - {match_ts.group(2)} {match_ts.group(3)}"
     
     # =========================================================================
     # PATRÓN 2: Solo timestamp cerca de palabras de firma/certificación
     # =========================================================================
-    palabras_contexto = '|'.join(PALABRAS_AREA_FIRMA + PALABRAS_CERTIFICACION)
-    if re.search(rf'({palabras_contexto})', texto_norm, re.IGNORECASE):
-        patron_ts_solo = r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}\s*(?:AM|PM)?(?:\s*(?:PDT|PST|EST|CST|MST|UTC)?)?)'
-        match_ts_solo = re.search(patron_ts_solo, texto_norm)
+    if puede_tener_timestamp and _RE_CONTEXTO_FIRMA.search(texto_norm):
+        match_ts_solo = _RE_TIMESTAMP_SOLO.search(texto_norm)
         if match_ts_solo:
             return True, "Firma Electronica (Timestamp)", match_ts_solo.group(1)
     
@@ -908,31 +972,34 @@ def detectar_firma(texto, page=None):
     # PATRÓN 3: Nombre después de palabras de certificación
     # Ejemplo: "Certifico haber leído... JUAN PEREZ"
     # =========================================================================
-    for palabra in PALABRAS_CERTIFICACION:
-        patron_cert = rf'{palabra}[^A-Z]{{0,100}}([A-ZÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s]{{5,40}}?)(?:\d{{1,2}}/|\n|Firma|$)'
-        match_cert = re.search(patron_cert, texto_norm, re.IGNORECASE)
+    for palabra, patron_cert in _RES_CERTIFICACION:
+        if palabra not in texto_lower:
+            continue
+        match_cert = patron_cert.search(texto_norm)
         if match_cert:
             nombre = match_cert.group(1).strip()
-            palabras_excluir = ['DOCUMENTO', 'SEGURO', 'TITULO', 'BANCO', 'DIVULGACIONES', 'PRESENTADAS']
-            if len(nombre) > 5 and not any(p in nombre.upper() for p in palabras_excluir):
+            nombre_upper = nombre.upper()
+            if len(nombre) > 5 and not any(p in nombre_upper for p in _EXCLUIR_NOMBRE_CERTIFICACION):
                 return True, "Firma Electronica", nombre
     
     # =========================================================================
     # PATRÓN 4: Marca X como firma
     # =========================================================================
-    if re.search(r'[xX]{1,3}\s*(?:Firma|Signature|___|---)', texto):
-        return True, "Firma con Marca X", "Marca X detectada"
-    if re.search(r'(?:Firma|Signature)\s*[:\s]*[xX]{1,3}', texto):
+    if 'x' in texto_lower and _RE_MARCA_X.search(texto):
         return True, "Firma con Marca X", "Marca X detectada"
     
     # =========================================================================
     # PATRÓN 5: Detección visual de firma manuscrita con OpenCV
     # =========================================================================
     if page is not None and OPENCV_DISPONIBLE:
-        # Intentar detectar firma en áreas conocidas
+        # Intentar detectar firma en áreas conocidas; el texto de la página se
+        # extrae una sola vez y se comparte entre las búsquedas
+        textpage = None
         for palabra in PALABRAS_AREA_FIRMA:
-            if palabra.lower() in texto.lower():
-                tiene_firma_visual, confianza, detalle = detectar_firma_manuscrita_en_area(page, palabra)
+            if palabra.lower() in texto_lower:
+                if textpage is None:
+                    textpage = page.get_textpage(flags=_FLAGS_BUSQUEDA)
+                tiene_firma_visual, confianza, detalle = detectar_firma_manuscrita_en_area(page, palabra, textpage=textpage)
                 if tiene_firma_visual and confianza > 40:
                     return True, "Firma Manuscrita", detalle
                 elif tiene_firma_visual and confianza > 25:
@@ -947,7 +1014,7 @@ def detectar_firma(texto, page=None):
     # PATRÓN 6: Área de firma detectada pero sin contenido verificable
     # =========================================================================
     for palabra in PALABRAS_AREA_FIRMA:
-        if palabra.lower() in texto.lower():
+        if palabra.lower() in texto_lower:
             if page is not None and OPENCV_DISPONIBLE:
                 return False, "Area de firma vacia", f"No se detecto contenido cerca de '{palabra}'"
             return None, "Area de firma detectada", f"Encontrado: '{palabra}' (instale OpenCV para verificacion visual)"
@@ -959,7 +1026,7 @@ def detectar_firma(texto, page=None):
 # FUNCIÓN: EXTRAER CAMPOS POR TIPO DE DOCUMENTO
 # =============================================================================
 
-def extraer_campos_por_tipo(texto, tipo_documento, page=None):
+def extraer_campos_por_tipo(texto, tipo_documento, page=None, continuaciones=""):
     """
     Extrae todos los campos configurados para un tipo de documento.
     
@@ -967,6 +1034,7 @@ def extraer_campos_por_tipo(texto, tipo_documento, page=None):
         texto: Texto extraído del documento
         tipo_documento: Tipo de documento detectado
         page: Objeto page de PyMuPDF (opcional, para detección visual de firmas)
+        continuaciones: Texto de las páginas de continuación del estudio de título
     """
     if tipo_documento not in TIPOS_DOCUMENTO:
         return {}
@@ -982,7 +1050,7 @@ def extraer_campos_por_tipo(texto, tipo_documento, page=None):
         elif patrones == "ULTIMA_FECHA":
             datos[campo] = extraer_ultima_fecha(texto)
         elif patrones == "ULTIMA_FECHA_ESTUDIO":
-            datos[campo] = extraer_ultima_fecha_estudio(texto)
+            datos[campo] = extraer_ultima_fecha_estudio(texto, continuaciones)
         elif patrones == "VERIFICAR_BLANCO":
             datos[campo] = verificar_linea_rechazo(texto)
         else:
@@ -996,7 +1064,7 @@ def extraer_campos_por_tipo(texto, tipo_documento, page=None):
                 valor = formatear_precio(valor)
             elif campo == "direccion_postal" and valor:
                 # Limpiar dirección y unir líneas
-                valor = re.sub(r'\s+', ' ', valor).strip()
+                valor = ' '.join(valor.split())
             elif campo == "finca" and valor:
                 # Limpiar comas extra al final
                 valor = valor.rstrip(',').strip()
@@ -1024,56 +1092,59 @@ def procesar_paquete(pdf_path):
     Procesa un paquete de documentos PDF.
     Detecta el tipo de cada página y extrae los campos correspondientes.
     """
-    global _texto_continuaciones_estudio
-    
     doc = fitz.open(pdf_path)
-    num_paginas = len(doc)
-    
-    # Estructura para almacenar resultados
-    documentos_encontrados = {}
-    paginas_por_tipo = {}
-    
-    print(f"  Analizando {num_paginas} páginas...")
-    
-    # Resetear texto de continuaciones
-    _texto_continuaciones_estudio = ""
-    
-    # Primera pasada: detectar tipo de cada página
-    for i in range(num_paginas):
-        texto = doc[i].get_text()
-        tipo = detectar_tipo_documento(texto)
+    try:
+        num_paginas = len(doc)
         
-        if tipo:
-            # Si es una continuación del estudio, guardar el texto pero no clasificar
-            if tipo == "ESTUDIO_TITULO_CONTINUACION":
-                _texto_continuaciones_estudio += "\n" + texto
-                print(f"    Página {i+1}: (continuación de estudio)")
-                continue
-            
-            if tipo not in paginas_por_tipo:
-                paginas_por_tipo[tipo] = []
-            paginas_por_tipo[tipo].append(i)
-            print(f"    Página {i+1}: {tipo}")
-        else:
-            print(f"    Página {i+1}: (no clasificada)")
-    
-    # Segunda pasada: extraer campos por tipo de documento
-    for tipo, paginas in paginas_por_tipo.items():
-        # Combinar texto de todas las páginas del mismo tipo
-        texto_combinado = "\n".join([doc[p].get_text() for p in paginas])
+        # Estructura para almacenar resultados
+        documentos_encontrados = {}
+        paginas_por_tipo = {}
         
-        # Usar la primera página del tipo para detección visual de firma
-        primera_pagina = doc[paginas[0]] if paginas else None
+        print(f"  Analizando {num_paginas} páginas...")
         
-        # Extraer campos
-        datos = extraer_campos_por_tipo(texto_combinado, tipo, page=primera_pagina)
+        # Texto de las páginas de continuación del estudio de título
+        texto_continuaciones = ""
         
-        documentos_encontrados[tipo] = {
-            "paginas": [p + 1 for p in paginas],  # 1-indexed para el reporte
-            "datos": datos
-        }
-    
-    doc.close()
+        # Extraer el texto de cada página una sola vez; lo usan ambas pasadas
+        textos = [doc[i].get_text() for i in range(num_paginas)]
+        
+        # Primera pasada: detectar tipo de cada página
+        for i, texto in enumerate(textos):
+            tipo = detectar_tipo_documento(texto)
+            
+            if tipo:
+                # Si es una continuación del estudio, guardar el texto pero no clasificar
+                if tipo == "ESTUDIO_TITULO_CONTINUACION":
+                    texto_continuaciones += "\n" + texto
+                    print(f"    Página {i+1}: (continuación de estudio)")
+                    continue
+                
+                if tipo not in paginas_por_tipo:
+                    paginas_por_tipo[tipo] = []
+                paginas_por_tipo[tipo].append(i)
+                print(f"    Página {i+1}: {tipo}")
+            else:
+                print(f"    Página {i+1}: (no clasificada)")
+        
+        # Segunda pasada: extraer campos por tipo de documento
+        for tipo, paginas in paginas_por_tipo.items():
+            # Combinar texto de todas las páginas del mismo tipo
+            texto_combinado = "\n".join(textos[p] for p in paginas)
+            
+            # Usar la primera página del tipo para detección visual de firma
+            primera_pagina = doc[paginas[0]] if paginas else None
+            
+            # Extraer campos
+            datos = extraer_campos_por_tipo(texto_combinado, tipo, page=primera_pagina,
+                                            continuaciones=texto_continuaciones)
+            
+            documentos_encontrados[tipo] = {
+                "paginas": [p + 1 for p in paginas],  # 1-indexed para el reporte
+                "datos": datos
+            }
+    finally:
+        # Cerrar siempre el documento, incluso si falla la extracción
+        doc.close()
     
     return documentos_encontrados, num_paginas
 
@@ -1217,6 +1288,10 @@ def generar_reporte(archivo, documentos, num_paginas, validaciones, alertas):
 # FUNCIONES DEL PIPELINE
 # =============================================================================
 
+# Tramos de caracteres no seguros y/o guiones bajos: se colapsan a un solo _
+_RE_TRAMO_NO_SEGURO = re.compile(r'(?:[^\w\-]|_)+')
+
+
 def sanitizar_nombre(nombre_pdf):
     """
     Convierte nombre de PDF a nombre seguro para archivos.
@@ -1224,21 +1299,62 @@ def sanitizar_nombre(nombre_pdf):
     """
     # Quitar extensión
     nombre = os.path.splitext(nombre_pdf)[0]
-    # Reemplazar caracteres problemáticos por _
-    nombre = re.sub(r'[^\w\-]', '_', nombre)
-    # Eliminar guiones bajos múltiples
-    nombre = re.sub(r'_+', '_', nombre)
+    # Reemplazar caracteres problemáticos por _ (sin dejar guiones bajos múltiples)
+    nombre = _RE_TRAMO_NO_SEGURO.sub('_', nombre)
     # Quitar _ al inicio y final
     nombre = nombre.strip('_')
     return nombre
 
 
+def _nombres_en_carpeta(carpeta):
+    """
+    Nombres (normalizados con normcase) de las entradas de una carpeta,
+    obtenidos en un solo listado. Vacío si la carpeta no existe.
+    """
+    try:
+        with os.scandir(carpeta or ".") as entradas:
+            return {os.path.normcase(e.name) for e in entradas}
+    except FileNotFoundError:
+        return set()
+
+
+def _listar_pdfs(carpeta):
+    """
+    Nombres de los PDFs de una carpeta (como glob("*.pdf"): sin ocultos y
+    sin distinguir mayúsculas en Windows), en un solo listado.
+    """
+    with os.scandir(carpeta or ".") as entradas:
+        return [
+            e.name for e in entradas
+            if not e.name.startswith(".")
+            and os.path.normcase(e.name).endswith(".pdf")
+            and e.is_file()
+        ]
+
+
+def _es_pdf_ocr(nombre_pdf):
+    """True si el nombre es de un PDF con OCR integrado (sufijo _OCR)."""
+    return os.path.normcase(nombre_pdf).endswith(os.path.normcase("_OCR.pdf"))
+
+
+def _carpetas_faltantes():
+    """Carpetas de CARPETAS que no existen (un listado por carpeta padre)."""
+    existentes = {}
+    faltantes = []
+    for carpeta in CARPETAS.values():
+        padre, base = os.path.split(os.path.normpath(carpeta))
+        if padre not in existentes:
+            existentes[padre] = _nombres_en_carpeta(padre)
+        if os.path.normcase(base) not in existentes[padre]:
+            faltantes.append(carpeta)
+    return faltantes
+
+
 def crear_carpetas():
     """Crea todas las carpetas necesarias si no existen."""
-    for nombre, carpeta in CARPETAS.items():
-        if not os.path.exists(carpeta):
-            os.makedirs(carpeta)
-            print(f"  Carpeta creada: {carpeta}/")
+    for carpeta in _carpetas_faltantes():
+        os.makedirs(carpeta, exist_ok=True)
+        print(f"  Carpeta creada: {carpeta}/")
 
 
 def inicializar_log():
@@ -1252,72 +1368,103 @@ def inicializar_log():
             f.write("archivo;etapa;resultado;timestamp;mensaje;intento_num\n")
 
 
+# Índice en memoria del log: errores por archivo y último intento por
+# (archivo, etapa). Se carga del CSV en la primera consulta de cada proceso
+# y escribir_log lo mantiene al día, así no se relee el log por cada PDF.
+_errores_por_archivo = {}
+_ultimo_intento = {}
+_indice_log_cargado = False
+
+
+def _indexar_linea_log(linea):
+    """Agrega una línea del log al índice en memoria."""
+    partes = linea.strip().split(";")
+    if len(partes) >= 3 and partes[2] == "ERROR":
+        _errores_por_archivo[partes[0]] = _errores_por_archivo.get(partes[0], 0) + 1
+    if len(partes) >= 6:
+        try:
+            intento = int(partes[5])
+        except ValueError:
+            return
+        clave = (partes[0], partes[1])
+        if intento > _ultimo_intento.get(clave, 0):
+            _ultimo_intento[clave] = intento
+
+
+def _cargar_indice_log():
+    """Lee el log CSV una sola vez por proceso y construye el índice."""
+    global _indice_log_cargado
+    if _indice_log_cargado:
+        return
+    _indice_log_cargado = True
+    if os.path.exists(LOG_FILE):
+        with open(LOG_FILE, "r", encoding="utf-8") as f:
+            for linea in f:
+                _indexar_linea_log(linea)
+
+
 def escribir_log(archivo, etapa, resultado, mensaje="-", intento_num=1):
     """Escribe una entrada en el log CSV."""
+    _cargar_indice_log()
     timestamp = datetime.now().isoformat()
+    registro = f"{archivo};{etapa};{resultado};{timestamp};{mensaje};{intento_num}\n"
     with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{archivo};{etapa};{resultado};{timestamp};{mensaje};{intento_num}\n")
+        f.write(registro)
+    # Indexar el registro tal como se leería del archivo (el mensaje puede
+    # traer saltos de línea)
+    for linea in io.StringIO(registro, newline=None):
+        _indexar_linea_log(linea)
 
 
 def contar_errores(archivo):
     """Cuenta cuántos errores tiene un archivo en el log."""
-    if not os.path.exists(LOG_FILE):
-        return 0
-    
-    errores = 0
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        for linea in f:
-            partes = linea.strip().split(";")
-            if len(partes) >= 3 and partes[0] == archivo and partes[2] == "ERROR":
-                errores += 1
-    return errores
+    _cargar_indice_log()
+    return _errores_por_archivo.get(archivo, 0)
 
 
 def obtener_ultimo_intento(archivo, etapa):
     """Obtiene el número del último intento para una etapa específica."""
-    if not os.path.exists(LOG_FILE):
-        return 0
-    
-    ultimo_intento = 0
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        for linea in f:
-            partes = linea.strip().split(";")
-            if len(partes) >= 6 and partes[0] == archivo and partes[1] == etapa:
-                try:
-                    intento = int(partes[5])
-                    if intento > ultimo_intento:
-                        ultimo_intento = intento
-                except:
-                    pass
-    return ultimo_intento
+    _cargar_indice_log()
+    return _ultimo_intento.get((archivo, etapa), 0)
 
 
 def limpiar_tmp_huerfanos():
     """Borra archivos .tmp con más de 1 hora de antigüedad."""
     carpeta = CARPETAS["resultados"]
-    if not os.path.exists(carpeta):
-        return
     
     ahora = time.time()
-    for tmp in glob(os.path.join(carpeta, "*.tmp")):
-        try:
-            edad = ahora - os.path.getmtime(tmp)
-            if edad > MAX_EDAD_TMP:
-                os.remove(tmp)
-                print(f"  Limpiado .tmp huérfano: {os.path.basename(tmp)}")
-        except Exception as e:
-            print(f"  Error limpiando {tmp}: {e}")
+    try:
+        # scandir trae la fecha de modificación junto con el listado
+        with os.scandir(carpeta) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith(".tmp"):
+                    continue
+                try:
+                    edad = ahora - entrada.stat().st_mtime
+                    if edad > MAX_EDAD_TMP:
+                        os.remove(entrada.path)
+                        print(f"  Limpiado .tmp huérfano: {entrada.name}")
+                except Exception as e:
+                    print(f"  Error limpiando {entrada.path}: {e}")
+    except FileNotFoundError:
+        return
 
 
 def mover_archivo(origen, destino):
-    """Mueve un archivo de una carpeta a otra."""
-    if os.path.exists(origen):
-        # Si ya existe en destino, eliminarlo primero
+    """Mueve un archivo de una carpeta a otra (reemplaza el destino si existe)."""
+    if not os.path.exists(origen):
+        return False
+    try:
+        # Un solo rename, que además reemplaza el destino existente
+        os.replace(origen, destino)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Otra unidad: copiar y borrar, eliminando antes el destino
         if os.path.exists(destino):
             os.remove(destino)
         shutil.move(origen, destino)
-        return True
-    return False
+    return True
 
 
 def hacer_ocr(nombre_pdf, ruta_entrada, ruta_salida):
@@ -1328,45 +1475,62 @@ def hacer_ocr(nombre_pdf, ruta_entrada, ruta_salida):
         True si fue exitoso, False si falló.
     """
     try:
+        if not TESSERACT_CMD:
+            raise Exception("Tesseract OCR no encontrado en las rutas conocidas")
         resultado = convertir_pdf_a_searchable(ruta_entrada, ruta_salida)
         return resultado is not None
     except Exception as e:
         raise Exception(f"Error en OCR: {str(e)}")
 
 
+def _lineas_txt_reporte(reporte, marca_alerta="!"):
+    """
+    Arma las líneas del TXT legible para un reporte (sin encabezado).
+    """
+    lineas = [
+        f"Archivo: {reporte['archivo']}\n",
+        f"Estado: {reporte['resumen_validacion']}\n",
+        f"Páginas: {reporte['total_paginas']}\n\n",
+        "DOCUMENTOS DETECTADOS:\n",
+    ]
+    for tipo, info in reporte['documentos_detectados'].items():
+        lineas.append(f"  {tipo} (Páginas {info['paginas']}):\n")
+        for campo, valor in info['datos'].items():
+            lineas.append(f"    {campo}: {valor}\n")
+        lineas.append("\n")
+    
+    lineas.append("VALIDACIONES:\n")
+    for val, estado in reporte['validaciones'].items():
+        lineas.append(f"  {val}: {estado}\n")
+    
+    if reporte['alertas']:
+        lineas.append("\nALERTAS:\n")
+        for alerta in reporte['alertas']:
+            lineas.append(f"  {marca_alerta} {alerta}\n")
+    return lineas
+
+
+def _escribir_txt_reporte(ruta_txt, titulo, lineas):
+    """
+    Escribe el TXT con encabezado (título y fecha) y las líneas dadas,
+    en una sola escritura.
+    """
+    encabezado = (
+        f"{titulo}\n"
+        f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        + "=" * 60 + "\n\n"
+    )
+    with open(ruta_txt, "w", encoding="utf-8") as f:
+        f.write(encabezado + "".join(lineas))
+
+
 def generar_txt_desde_reporte(reporte, ruta_txt):
     """
     Genera un archivo TXT legible a partir del reporte.
     """
-    with open(ruta_txt, "w", encoding="utf-8") as f:
-        f.write("REPORTE DE VERIFICACIÓN DE PRÉSTAMOS\n")
-        f.write(f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("=" * 60 + "\n\n")
-        
-        f.write(f"Archivo: {reporte['archivo']}\n")
-        f.write(f"Estado: {reporte['resumen_validacion']}\n")
-        f.write(f"Páginas: {reporte['total_paginas']}\n\n")
-        
-        f.write("DOCUMENTOS DETECTADOS:\n")
-        for tipo, info in reporte['documentos_detectados'].items():
-            f.write(f"  {tipo} (Páginas {info['paginas']}):\n")
-            for campo, valor in info['datos'].items():
-                if isinstance(valor, dict):
-                    f.write(f"    {campo}: {valor}\n")
-                else:
-                    f.write(f"    {campo}: {valor}\n")
-            f.write("\n")
-        
-        f.write("VALIDACIONES:\n")
-        for val, estado in reporte['validaciones'].items():
-            f.write(f"  {val}: {estado}\n")
-        
-        if reporte['alertas']:
-            f.write("\nALERTAS:\n")
-            for alerta in reporte['alertas']:
-                f.write(f"  ! {alerta}\n")
-        
-        f.write("\n" + "=" * 60 + "\n")
+    lineas = _lineas_txt_reporte(reporte)
+    lineas.append("\n" + "=" * 60 + "\n")
+    _escribir_txt_reporte(ruta_txt, "REPORTE DE VERIFICACIÓN DE PRÉSTAMOS", lineas)
 
 
 def generar_json_pipeline(nombre_pdf, ruta_pdf_ocr, ruta_json_final, ruta_txt_final):
@@ -1391,15 +1555,17 @@ def generar_json_pipeline(nombre_pdf, ruta_pdf_ocr, ruta_json_final, ruta_txt_fi
         reporte = generar_reporte(ruta_pdf_ocr, documentos, num_paginas, validaciones, alertas)
         
         # Escribir JSON a archivo temporal
-        with open(ruta_tmp_json, "w", encoding="utf-8") as f:
-            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        with open(ruta_tmp_json, "wb") as f:
+            f.write(json_a_bytes(reporte))
         
         # Escribir TXT a archivo temporal
         generar_txt_desde_reporte(reporte, ruta_tmp_txt)
         
-        # Renombrar a archivos finales (atómico)
-        os.rename(ruta_tmp_json, ruta_json_final)
-        os.rename(ruta_tmp_txt, ruta_txt_final)
+        # Renombrar a archivos finales, seguidos y sin trabajo entre ambos.
+        # El JSON va último: su existencia marca el PDF como procesado,
+        # así que nunca aparece sin su TXT.
+        os.replace(ruta_tmp_txt, ruta_txt_final)
+        os.replace(ruta_tmp_json, ruta_json_final)
         
         return True
         
@@ -1508,6 +1674,12 @@ def procesar_pdf_pipeline(nombre_pdf, skip_ocr=False):
         return "ERROR"
 
 
+def _procesar_pdf_en_paralelo(nombre_pdf, skip_ocr):
+    """procesar_pdf_pipeline para el pool: cada línea lleva el nombre del PDF."""
+    with salida_con_prefijo(f"[{nombre_pdf}] "):
+        return procesar_pdf_pipeline(nombre_pdf, skip_ocr=skip_ocr)
+
+
 def ejecutar_pipeline(skip_ocr=False):
     """
     Ejecuta el pipeline completo para todos los PDFs pendientes.
@@ -1535,8 +1707,7 @@ def ejecutar_pipeline(skip_ocr=False):
     print("\n[3/3] Procesando PDFs...")
     
     # Listar PDFs en carpeta de entrada
-    patron = os.path.join(CARPETAS["entrada"], "*.pdf")
-    pdfs = glob(patron)
+    pdfs = _listar_pdfs(CARPETAS["entrada"])
     
     if not pdfs:
         print(f"\n  No hay PDFs en {CARPETAS['entrada']}/")
@@ -1553,10 +1724,33 @@ def ejecutar_pipeline(skip_ocr=False):
         "LIMITE_ERRORES": 0,
     }
     
+    # Los que ya tienen JSON se ignoran aquí, con un solo listado de la
+    # carpeta de resultados, sin pasar por procesar_pdf_pipeline
+    jsons_existentes = _nombres_en_carpeta(CARPETAS["resultados"])
+    
+    # Los PDFs son independientes salvo cuando sus nombres sanitizados
+    # coinciden (escriben el mismo JSON): esos repetidos van después, en
+    # serie, para que sigan viendo el JSON ya generado y se ignoren
+    nombres_sanitizados = set()
+    en_paralelo, en_serie = [], []
+    for nombre_pdf in pdfs:
+        nombre_sanitizado = sanitizar_nombre(nombre_pdf)
+        if os.path.normcase(f"{nombre_sanitizado}.json") in jsons_existentes:
+            print(f"  [--] {nombre_pdf}: JSON ya existe, ignorando")
+            resultados["IGNORADO"] += 1
+            continue
+        (en_serie if nombre_sanitizado in nombres_sanitizados else en_paralelo).append(nombre_pdf)
+        nombres_sanitizados.add(nombre_sanitizado)
+    
     # Procesar cada PDF
-    for ruta_pdf in pdfs:
-        nombre_pdf = os.path.basename(ruta_pdf)
-        resultado = procesar_pdf_pipeline(nombre_pdf, skip_ocr=skip_ocr)
+    if PDFS_EN_PARALELO > 1 and len(en_paralelo) > 1:
+        with ProcessPoolExecutor(max_workers=min(PDFS_EN_PARALELO, len(en_paralelo))) as executor:
+            estados = list(executor.map(_procesar_pdf_en_paralelo, en_paralelo, [skip_ocr] * len(en_paralelo)))
+    else:
+        estados = [procesar_pdf_pipeline(nombre_pdf, skip_ocr=skip_ocr) for nombre_pdf in en_paralelo]
+    estados += [procesar_pdf_pipeline(nombre_pdf, skip_ocr=skip_ocr) for nombre_pdf in en_serie]
+    
+    for resultado in estados:
         resultados[resultado] = resultados.get(resultado, 0) + 1
     
     # --- Resumen ---
@@ -1583,9 +1777,10 @@ def inicializar_estructura():
     
     # --- Crear carpetas ---
     print("\n[1/2] Creando carpetas...")
+    faltantes = _carpetas_faltantes()
     for carpeta in CARPETAS.values():
-        if not os.path.exists(carpeta):
-            os.makedirs(carpeta)
+        if carpeta in faltantes:
+            os.makedirs(carpeta, exist_ok=True)
             print(f"  [OK] Creada: {carpeta}/")
         else:
             print(f"  [--] Ya existe: {carpeta}/")
@@ -1594,14 +1789,16 @@ def inicializar_estructura():
     print("\n[2/2] Buscando PDFs en la raíz para mover...")
     
     # Buscar PDFs en la carpeta actual (raíz)
-    pdfs_raiz = [f for f in glob("*.pdf") if not f.endswith("_OCR.pdf")]
-    pdfs_ocr = glob("*_OCR.pdf")
+    pdfs = _listar_pdfs(".")
+    pdfs_raiz = [f for f in pdfs if not _es_pdf_ocr(f)]
+    pdfs_ocr = [f for f in pdfs if _es_pdf_ocr(f)]
     
     if pdfs_raiz:
         print(f"\n  Encontrados {len(pdfs_raiz)} PDFs originales:")
+        en_entrada = _nombres_en_carpeta(CARPETAS["entrada"])
         for pdf in pdfs_raiz:
             destino = os.path.join(CARPETAS["entrada"], pdf)
-            if not os.path.exists(destino):
+            if os.path.normcase(pdf) not in en_entrada:
                 shutil.move(pdf, destino)
                 print(f"    [OK] Movido: {pdf} -> {CARPETAS['entrada']}/")
             else:
@@ -1611,9 +1808,10 @@ def inicializar_estructura():
     
     if pdfs_ocr:
         print(f"\n  Encontrados {len(pdfs_ocr)} PDFs con OCR:")
+        en_ocr = _nombres_en_carpeta(CARPETAS["ocr"])
         for pdf in pdfs_ocr:
             destino = os.path.join(CARPETAS["ocr"], pdf)
-            if not os.path.exists(destino):
+            if os.path.normcase(pdf) not in en_ocr:
                 shutil.move(pdf, destino)
                 print(f"    [OK] Movido: {pdf} -> {CARPETAS['ocr']}/")
             else:
@@ -1663,8 +1861,11 @@ def procesar_archivo_individual(archivo_entrada, directorio_salida):
         # Generar reporte
         reporte = generar_reporte(archivo_entrada, documentos, num_paginas, validaciones, alertas)
         
+        # Serializar una sola vez: se muestra y se guarda lo mismo
+        datos_json = json_a_bytes(reporte)
+        
         # Mostrar resultado
-        print(json.dumps(reporte, indent=2, ensure_ascii=False))
+        print(datos_json.decode("utf-8"))
         print("-" * 60)
         
         # Crear directorio de salida si no existe
@@ -1680,37 +1881,12 @@ def procesar_archivo_individual(archivo_entrada, directorio_salida):
         txt_path = os.path.join(directorio_salida, f"{base_name}_resultado.txt")
         
         # Guardar JSON
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        with open(json_path, "wb") as f:
+            f.write(datos_json)
         
         # Guardar TXT legible
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write("REPORTE DE VERIFICACIÓN DE PRÉSTAMO\n")
-            f.write(f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write("=" * 60 + "\n\n")
-            
-            f.write(f"Archivo: {reporte['archivo']}\n")
-            f.write(f"Estado: {reporte['resumen_validacion']}\n")
-            f.write(f"Páginas: {reporte['total_paginas']}\n\n")
-            
-            f.write("DOCUMENTOS DETECTADOS:\n")
-            for tipo, info in reporte['documentos_detectados'].items():
-                f.write(f"  {tipo} (Páginas {info['paginas']}):\n")
-                for campo, valor in info['datos'].items():
-                    if isinstance(valor, dict):
-                        f.write(f"    {campo}: {valor}\n")
-                    else:
-                        f.write(f"    {campo}: {valor}\n")
-                f.write("\n")
-            
-            f.write("VALIDACIONES:\n")
-            for val, estado in reporte['validaciones'].items():
-                f.write(f"  {val}: {estado}\n")
-            
-            if reporte['alertas']:
-                f.write("\nALERTAS:\n")
-                for alerta in reporte['alertas']:
-                    f.write(f"  [!] {alerta}\n")
+        _escribir_txt_reporte(txt_path, "REPORTE DE VERIFICACIÓN DE PRÉSTAMO",
+                             _lineas_txt_reporte(reporte, marca_alerta="[!]"))
         
         print(f"\nResultados guardados en:")
         print(f"  - {json_path}")
@@ -1725,6 +1901,73 @@ def procesar_archivo_individual(archivo_entrada, directorio_salida):
         return False
 
 
+def hash_archivo(ruta):
+    """Retorna el SHA-1 (hex) del contenido de un archivo."""
+    with open(ruta, "rb") as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        h = hashlib.sha1()
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloque)
+        return h.hexdigest()
+
+
+def _leer_cache(ruta_cache):
+    """Retorna el reporte guardado en caché, o None si no hay uno válido."""
+    try:
+        with open(ruta_cache, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        # Inexistente, ilegible o truncado: se trata como si no estuviera
+        return None
+
+
+def _guardar_cache(ruta_cache, reporte):
+    """Guarda el reporte en caché con escritura atómica (.tmp -> .json)."""
+    ruta_tmp = f"{ruta_cache}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        with open(ruta_tmp, "wb") as f:
+            f.write(json_a_bytes(reporte))
+        os.replace(ruta_tmp, ruta_cache)
+    except OSError as e:
+        # Sin caché el reporte sigue siendo válido
+        print(f"  Advertencia: no se pudo guardar la caché de {reporte['archivo']}: {e}")
+        try:
+            os.remove(ruta_tmp)
+        except OSError:
+            pass
+
+
+def verificar_archivo(archivo, usar_cache=True):
+    """
+    Procesa un PDF y genera su reporte (modo legacy).
+    Se ejecuta en un proceso aparte; retorna None si falla. Cada línea que
+    imprime lleva el nombre del archivo.
+    Si el mismo contenido ya se verificó antes, reutiliza el reporte en caché
+    (salvo con usar_cache=False).
+    """
+    with salida_con_prefijo(f"[{os.path.basename(archivo)}] "):
+        try:
+            ruta_cache = os.path.join(CARPETA_CACHE, f"v{CACHE_VERSION}_{hash_archivo(archivo)}.json")
+            if usar_cache:
+                reporte = _leer_cache(ruta_cache)
+                if reporte is not None:
+                    reporte["archivo"] = os.path.basename(archivo)
+                    return reporte
+            
+            documentos, num_paginas = procesar_paquete(archivo)
+            validaciones, alertas = validar_consistencia(documentos)
+            reporte = generar_reporte(archivo, documentos, num_paginas, validaciones, alertas)
+            
+            _guardar_cache(ruta_cache, reporte)
+            return reporte
+        except Exception as e:
+            print(f"  ERROR procesando {archivo}: {e}")
+            traceback.print_exc()
+            return None
+
+
 def main():
     """Función principal del script."""
     # Configurar argumentos de línea de comandos
@@ -1738,6 +1981,7 @@ Modos de operación:
   --pipeline --skip-ocr  Ejecuta pipeline sin aplicar OCR (usa PDFs existentes)
   --input <archivo>    Procesa un archivo individual (para Power Automate)
   (sin argumentos)     Modo legacy: procesa PDFs en directorio actual
+  --no-cache           Modo legacy sin reutilizar reportes en caché
 
 Ejemplos:
   python verificar_prestamos_v3.py --init
@@ -1754,6 +1998,8 @@ Ejemplos:
                         help='Ejecuta el pipeline completo (OCR + verificación)')
     parser.add_argument('--skip-ocr', action='store_true',
                         help='Salta el paso de OCR (usar con --pipeline)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignora los reportes en caché y vuelve a verificar (modo legacy)')
     
     args = parser.parse_args()
     
@@ -1782,13 +2028,14 @@ Ejemplos:
         sys.exit(0 if exito else 2)  # 0=APROBADO, 2=REVISIÓN REQUERIDA o error
     
     # Modo legacy (buscar archivos en directorio actual)
-    archivos_ocr = glob.glob("*_OCR.pdf")
+    pdfs = _listar_pdfs(".")
+    archivos_ocr = [f for f in pdfs if _es_pdf_ocr(f)]
     
     if archivos_ocr:
         print("Usando archivos con OCR integrado (_OCR.pdf)\n")
         archivos = archivos_ocr
     else:
-        archivos = [f for f in glob.glob("*.pdf") if not f.endswith("_OCR.pdf")]
+        archivos = [f for f in pdfs if not _es_pdf_ocr(f)]
         if archivos:
             print("ADVERTENCIA: No se encontraron archivos _OCR.pdf")
             print("Usando archivos originales (puede haber errores de extracción)\n")
@@ -1800,66 +2047,38 @@ Ejemplos:
     
     reportes = []
     
-    for archivo in archivos:
+    # Cada archivo es independiente: procesarlos en paralelo, un proceso por CPU
+    print(f"Procesando {len(archivos)} archivo(s)...")
+    if len(archivos) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(archivos), os.cpu_count() or 1)) as executor:
+            resultados = list(executor.map(verificar_archivo, archivos, [not args.no_cache] * len(archivos)))
+    else:
+        resultados = [verificar_archivo(archivos[0], usar_cache=not args.no_cache)]
+    
+    for archivo, reporte in zip(archivos, resultados):
         print("=" * 60)
-        print(f"Procesando: {archivo}")
+        print(f"Archivo: {archivo}")
         
-        try:
-            # Procesar el paquete
-            documentos, num_paginas = procesar_paquete(archivo)
-            
-            # Validar consistencia
-            validaciones, alertas = validar_consistencia(documentos)
-            
-            # Generar reporte
-            reporte = generar_reporte(archivo, documentos, num_paginas, validaciones, alertas)
-            reportes.append(reporte)
-            
-            # Mostrar resultado
-            print(json.dumps(reporte, indent=2, ensure_ascii=False))
-            print("-" * 60)
-            
-        except Exception as e:
-            print(f"  ERROR procesando {archivo}: {e}")
-            traceback.print_exc()
+        if reporte is None:
+            continue
+        reportes.append(reporte)
+        
+        # Mostrar resultado
+        print(json_a_bytes(reporte).decode("utf-8"))
+        print("-" * 60)
     
     # Guardar reportes
     if reportes:
         # JSON
-        with open("reporte_verificacion.json", "w", encoding="utf-8") as f:
-            json.dump(reportes, f, indent=2, ensure_ascii=False)
+        with open("reporte_verificacion.json", "wb") as f:
+            f.write(json_a_bytes(reportes))
         
         # TXT legible
-        with open("reporte_verificacion.txt", "w", encoding="utf-8") as f:
-            f.write("REPORTE DE VERIFICACIÓN DE PRÉSTAMOS\n")
-            f.write(f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write("=" * 60 + "\n\n")
-            
-            for reporte in reportes:
-                f.write(f"Archivo: {reporte['archivo']}\n")
-                f.write(f"Estado: {reporte['resumen_validacion']}\n")
-                f.write(f"Páginas: {reporte['total_paginas']}\n\n")
-                
-                f.write("DOCUMENTOS DETECTADOS:\n")
-                for tipo, info in reporte['documentos_detectados'].items():
-                    f.write(f"  {tipo} (Páginas {info['paginas']}):\n")
-                    for campo, valor in info['datos'].items():
-                        if isinstance(valor, dict):
-                            f.write(f"    {campo}: {valor}\n")
-                        else:
-                            f.write(f"    {campo}: {valor}\n")
-                    f.write("\n")
-                
-                f.write("VALIDACIONES:\n")
-                for val, estado in reporte['validaciones'].items():
-                    f.write(f"  {val}: {estado}\n")
-                
-                if reporte['alertas']:
-                    f.write("\nALERTAS:\n")
-                    for alerta in reporte['alertas']:
-                        f.write(f"  [!] {alerta}\n")
-                
-                f.write("\n" + "=" * 60 + "\n\n")
+        lineas = []
+        for reporte in reportes:
+            lineas += _lineas_txt_reporte(reporte, marca_alerta="[!]")
+            lineas.append("\n" + "=" * 60 + "\n\n")
+        _escribir_txt_reporte("reporte_verificacion.txt", "REPORTE DE VERIFICACIÓN DE PRÉSTAMOS", lineas)
         
         print("\n" + "=" * 60)
         print("Reportes guardados en:")
@@ -1868,5 +2087,6 @@ Ejemplos:
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
 